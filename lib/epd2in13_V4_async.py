@@ -0,0 +1,242 @@
+# *****************************************************************************
+# * | File        :	  epd2in13_V4_async.py
+# * | Function    :   asyncio variant of the epd2in13_V4 driver
+# * | Info        :   BUSY waits are driven by gpiozero edge events
+# -----------------------------------------------------------------------------
+# Same license as epd2in13_V4.py.
+#
+
+import asyncio
+import logging
+import time
+from . import epdconfig
+from .epd2in13_V4 import EPD
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEPD(EPD):
+    BUSY_TIMEOUT = 10  # seconds, a full refresh takes about 2s
+
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self.idle = None  # asyncio.Event, set while BUSY is low
+        self.sleeping = False  # deep sleep keeps BUSY high until the next hardware reset
+        self.metrics = {
+            'spi_bytes': 0,
+            'busy_waits': 0,
+            'busy_seconds': 0.0,
+        }
+
+    def send_command(self, command):
+        self.metrics['spi_bytes'] += 1
+        super().send_command(command)
+
+    def send_data(self, data):
+        self.metrics['spi_bytes'] += 1
+        super().send_data(data)
+
+    def send_data2(self, data):
+        self.metrics['spi_bytes'] += len(data)
+        super().send_data2(data)
+
+    '''
+    function : Watch the busy pin edges
+    parameter:
+    '''
+    def watch_busy(self):
+        if self.idle is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.idle = asyncio.Event()
+        if epdconfig.digital_read(self.busy_pin) == 0:
+            self.idle.set()
+        # gpiozero callbacks run in its own thread
+        epdconfig.GPIO_BUSY_PIN.when_activated = lambda: self.loop.call_soon_threadsafe(self.idle.clear)
+        epdconfig.GPIO_BUSY_PIN.when_deactivated = lambda: self.loop.call_soon_threadsafe(self.idle.set)
+
+    def arm(self):
+        '''mark the panel busy before a command raising BUSY, so that a
+        falling edge seen before the wait still completes it'''
+        self.watch_busy()
+        self.idle.clear()
+
+    @property
+    def busy(self):
+        return self.idle is not None and not self.idle.is_set() and not self.sleeping
+
+    '''
+    function : Wait until the busy_pin goes LOW, without polling
+    parameter:
+        timeout : seconds before giving up
+    '''
+    async def ReadBusy(self, timeout=BUSY_TIMEOUT):
+        if self.sleeping:
+            # BUSY stays high in deep sleep, the reset waking the panel up clears it
+            return
+        self.watch_busy()
+        logger.debug("e-Paper busy")
+        begin = time.monotonic()
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            # no edge seen: the command may not have raised BUSY at all
+            if epdconfig.digital_read(self.busy_pin) == 1:
+                raise TimeoutError(f"e-Paper still busy after {timeout}s")
+            logger.warning("e-Paper busy edge missed")
+            self.idle.set()
+        finally:
+            self.metrics['busy_waits'] += 1
+            self.metrics['busy_seconds'] += time.monotonic() - begin
+        logger.debug("e-Paper busy release")
+
+    async def reset(self):
+        self.sleeping = False
+        self.arm()
+        epdconfig.digital_write(self.reset_pin, 1)
+        await asyncio.sleep(0.02)
+        epdconfig.digital_write(self.reset_pin, 0)
+        await asyncio.sleep(0.002)
+        epdconfig.digital_write(self.reset_pin, 1)
+        await asyncio.sleep(0.02)
+
+    def activate(self, mode):
+        self.send_command(0x22) # Display Update Control
+        self.send_data(mode)
+        self.arm()
+        self.send_command(0x20) # Activate Display Update Sequence
+
+    async def TurnOnDisplay(self, wait=True):
+        self.activate(0xF7)
+        if wait:
+            await self.ReadBusy()
+
+    async def TurnOnDisplayPart(self, wait=True):
+        self.activate(0xFF)     # fast:0x0c, quality:0x0f, 0xcf
+        if wait:
+            await self.ReadBusy()
+
+    def setup_partial(self):
+        epdconfig.digital_write(self.reset_pin, 0)
+        epdconfig.delay_ms(1)
+        epdconfig.digital_write(self.reset_pin, 1)
+        self.sleeping = False
+
+        self.send_command(0x01) #Driver output control
+        self.send_data(0xf9)
+        self.send_data(0x00)
+        self.send_data(0x00)
+
+        self.send_command(0x3C) #BorderWavefrom
+        self.send_data(0x80)
+
+        self.send_command(0x11) #data entry mode
+        self.send_data(0x03)
+
+        self.SetWindow(0, 0, self.width - 1, self.height - 1)
+        self.SetCursor(0, 0)
+
+    async def init(self, update):
+        if (epdconfig.module_init() != 0):
+            return -1
+
+        if update == self.FULL_UPDATE:
+            await self.reset()
+
+            await self.ReadBusy()
+            self.arm()
+            self.send_command(0x12)  #SWRESET
+            await self.ReadBusy()
+
+            self.send_command(0x01) #Driver output control
+            self.send_data(0xf9)
+            self.send_data(0x00)
+            self.send_data(0x00)
+
+            self.send_command(0x11) #data entry mode
+            self.send_data(0x03)
+
+            self.SetWindow(0, 0, self.width-1, self.height-1)
+            self.SetCursor(0, 0)
+
+            self.send_command(0x3c)
+            self.send_data(0x05)
+
+            self.send_command(0x21) #  Display update control
+            self.send_data(0x00)
+            self.send_data(0x80)
+
+            self.send_command(0x18)
+            self.send_data(0x80)
+
+            await self.ReadBusy()
+
+        else:
+            self.setup_partial()
+
+        return 0
+
+    async def display(self, image):
+        self.send_command(0x24)
+        self.send_data2(image)
+        await self.TurnOnDisplay()
+
+    '''
+    function : Sends the image buffer and partial refresh
+    parameter:
+        image : Image data
+        wait : return once the waveform is over, else right after it started
+    '''
+    async def displayPartial(self, image, wait=True):
+        if self.busy:
+            await self.ReadBusy()
+        self.setup_partial()
+
+        self.send_command(0x24) # WRITE_RAM
+        self.send_data2(image)
+        await self.TurnOnDisplayPart(wait)
+
+    '''
+    function : Sends a window of the image and partial refresh
+    parameter:
+        image : Image data of the window only, row after row
+        x_start, x_end : first and last pixel columns, x_start multiple of 8
+        y_start, y_end : first and last rows
+    '''
+    async def displayPartialWindow(self, image, x_start, y_start, x_end, y_end, wait=True):
+        if self.busy:
+            await self.ReadBusy()
+        self.setup_partial()
+        self.SetWindow(x_start, y_start, x_end, y_end)
+        self.SetCursor(x_start >> 3, y_start) # the X address counter counts bytes
+
+        self.send_command(0x24) # WRITE_RAM
+        self.send_data2(image)
+        await self.TurnOnDisplayPart(wait)
+
+    async def displayPartBaseImage(self, image, wait=True):
+        self.send_command(0x24)
+        self.send_data2(image)
+
+        self.send_command(0x26)
+        self.send_data2(image)
+        await self.TurnOnDisplay(wait)
+
+    async def Clear(self, color):
+        self.send_command(0x24)
+        self.send_data2([color] * (((self.width + 7) // 8) * self.height))
+        await self.TurnOnDisplay()
+
+    async def sleep(self):
+        if self.sleeping:
+            return
+        if self.busy:
+            await self.ReadBusy()
+        self.send_command(0x10) #enter deep sleep
+        self.send_data(0x01)
+        self.sleeping = True
+        # deep sleep needs no settle time before the next reset, unlike module_exit
+        await asyncio.sleep(0.1)
+
+### END OF FILE ###
@@ -50,6 +50,11 @@ address = 0x0
 # address = 0x48
 bus     = SMBus(1)
 
+# SPI clock and bytes per transfer, set from the calibration of micro_player.spi
+# before module_init. 4096 is the default bufsiz of spidev.
+SPI_SPEED_HZ = 10000000
+SPI_CHUNK    = 4096
+
 
 GPIO_RST_PIN    = gpiozero.LED(EPD_RST_PIN)
 GPIO_DC_PIN     = gpiozero.LED(EPD_DC_PIN)
@@ -95,7 +100,15 @@ def spi_writebyte(data):
     spi.writebytes(data)
 
 def spi_writebyte2(data):
-    spi.writebytes2(data)
+    if len(data) <= SPI_CHUNK:
+        spi.writebytes2(data)
+        return
+    view = memoryview(bytes(data))
+    for start in range(0, len(view), SPI_CHUNK):
+        spi.writebytes2(view[start:start + SPI_CHUNK])
+
+def spi_readbytes(len):
+    return spi.readbytes(len)
 
 def i2c_writebyte(reg, value):
     bus.write_word_data(address, (reg>>8) & 0xff, (reg & 0xff) | ((value & 0xff) << 8))
@@ -112,7 +125,7 @@ def i2c_readbyte(reg, len):
 
 def module_init():
    
-    spi.max_speed_hz = 10000000
+    spi.max_speed_hz = SPI_SPEED_HZ
     spi.mode = 0b00
     
     return 0
@@ -43,6 +43,10 @@ class GT1151:
         buf = self.GT_Read(0x8140, 4)
         print(buf)
 
+    def on_touch(self, callback):
+        # INT is pulled low on each touch report, callback runs in a gpiozero thread
+        config.GPIO_INT.when_deactivated = callback
+
     def GT_Init(self):
         self.GT_Reset()
         self.GT_ReadVersion()
@@ -0,0 +1,118 @@
+import asyncio
+import io
+import re
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from . import config
+from .cache import LRUCache
+from .dither import dither
+
+ARTWORK_SIZE = (75, 75)
+
+# PIL releases the GIL while decoding and resampling, so a thread pool keeps the
+# event loop responsive without the memory cost of worker processes.
+_executor = ThreadPoolExecutor(max_workers=config.ARTWORK_WORKERS, thread_name_prefix='artwork')
+_pending = None
+
+# CachedArtwork by artwork url
+artwork_cache = LRUCache(config.ARTWORK_CACHE_SIZE)
+fetch_metrics = {
+    'fetches': 0,
+    'not_modified': 0,
+    'bytes': 0,
+    'seconds': 0.0,
+}
+
+# LMS resizes covers and proxied images when asked for image_WxH_o / cover_WxH_o
+_RESIZABLE = re.compile(r'^(.*/(?:music/[^/]+/cover|imageproxy/.+/image))(?:_[^/.]*)?(\.\w+)?$')
+_MAX_AGE = re.compile(r'max-age=(\d+)')
+
+
+class CachedArtwork:
+    __slots__ = ("artwork", "etag", "last_modified", "expires")
+
+    def __init__(self, artwork, headers):
+        self.artwork = artwork
+        self.etag = None
+        self.last_modified = None
+        self.revalidated(headers)
+
+    def revalidated(self, headers):
+        """refresh validators and freshness from response headers."""
+        self.etag = headers.get('ETag', self.etag)
+        self.last_modified = headers.get('Last-Modified', self.last_modified)
+        max_age = _MAX_AGE.search(headers.get('Cache-Control', ''))
+        self.expires = time.monotonic() + (int(max_age.group(1)) if max_age else config.ARTWORK_MAX_AGE)
+
+    @property
+    def fresh(self):
+        return time.monotonic() < self.expires
+
+    def conditional_headers(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+def sized_artwork_url(url, size=ARTWORK_SIZE):
+    """ask LMS for a cover already scaled to size."""
+    parts = urllib.parse.urlsplit(url)
+    match = _RESIZABLE.match(parts.path)
+    if not match:
+        return url
+    path = f"{match.group(1)}_{size[0]}x{size[1]}_o{match.group(2) or '.png'}"
+    return urllib.parse.urlunsplit(parts._replace(path=path))
+
+
+def proxied_artwork_url(url):
+    """route an external cover through the LMS image proxy, which can resize it."""
+    if url.startswith(('http://', 'https://')):
+        return f"/imageproxy/{urllib.parse.quote(url, safe='')}/image.jpg"
+    return url
+
+
+def pack_artwork(image):
+    """reduce an artwork to the packed 1-bit thumbnail drawn on the panel."""
+    if image.size != ARTWORK_SIZE:
+        image = image.resize(ARTWORK_SIZE, Image.Resampling.LANCZOS)
+    return dither(image, config.DITHER_MODE)
+
+
+def unpack_artwork(data):
+    """decode a packed 1-bit thumbnail."""
+    return Image.frombytes('1', ARTWORK_SIZE, data)
+
+
+def decode_artwork(data):
+    """decode an encoded cover straight to a packed 1-bit thumbnail.
+
+    JPEG covers are decoded in grayscale at the smallest DCT scale (1/2 to 1/8)
+    still covering the thumbnail, other formats are reduced by an integer
+    factor before the final resampling. The 1-bit reduction uses DITHER_MODE.
+    """
+    image = Image.open(io.BytesIO(data))
+    image.draft('L', ARTWORK_SIZE)
+    image = image.convert('L')
+    if image.size != ARTWORK_SIZE:
+        image = image.resize(ARTWORK_SIZE, Image.Resampling.LANCZOS, reducing_gap=2.0)
+    return dither(image, config.DITHER_MODE)
+
+
+async def run_in_pool(func, *args):
+    """run a CPU-heavy image step in the bounded artwork pool.
+
+    At most two jobs per worker are queued. Cancelling the awaiting task drops
+    the job if it has not started yet.
+    """
+    global _pending
+    if _pending is None:
+        _pending = asyncio.Semaphore(config.ARTWORK_WORKERS * 2)
+    async with _pending:
+        return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
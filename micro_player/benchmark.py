@@ -0,0 +1,160 @@
+"""Benchmarks meant to be run on the target: ``python -m micro_player.benchmark <name>``."""
+import argparse
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import time
+
+from PIL import Image
+
+from .artwork import ARTWORK_SIZE, decode_artwork, pack_artwork
+from .dither import MODES, dither
+from .favorites import favorites_footprint
+from .lms import Album
+
+
+class LegacyAlbum:
+    """dict-backed album holding the decoded source artwork, as before packing."""
+
+    def __init__(self, artist="", album="", artwork=None, url=""):
+        self.artist = artist
+        self.album = album
+        self.artwork = artwork
+        self.url = url
+
+
+def _image_footprint(image):
+    # PIL stores one byte per pixel for 1/L/P and four bytes per pixel otherwise
+    pixel_size = 1 if image.mode in ('1', 'L', 'P') else 4
+    return sys.getsizeof(image) + image.width * image.height * pixel_size
+
+
+def _legacy_footprint(albums):
+    size = sys.getsizeof(albums)
+    for album in albums:
+        size += sys.getsizeof(album) + sys.getsizeof(album.__dict__)
+        size += sum(sys.getsizeof(value) for name, value in vars(album).items() if name != 'artwork')
+        size += _image_footprint(album.artwork)
+    return size
+
+
+def bench_memory(args):
+    """compare favorites memory between decoded artwork and packed thumbnails."""
+    cover = Image.new('RGB', (args.size, args.size), (128, 64, 32))
+    legacy = [
+        LegacyAlbum(artist=f"artist {i}", album=f"album {i}", artwork=cover.copy(), url=f"spotify:album:{i}")
+        for i in range(args.count)
+    ]
+    packed = pack_artwork(cover)
+    compact = [
+        Album(artist=f"artist {i}", album=f"album {i}", artwork=bytes(packed), url=f"spotify:album:{i}")
+        for i in range(args.count)
+    ]
+    before = _legacy_footprint(legacy)
+    after = favorites_footprint(compact)
+    print(f"{args.count} favorites with {args.size}x{args.size} covers")
+    print(f"  before: {before / 1024:.0f} KiB ({before // args.count} bytes/favorite)")
+    print(f"  after:  {after / 1024:.0f} KiB ({after // args.count} bytes/favorite)")
+
+
+def _legacy_decode(data):
+    image = Image.open(io.BytesIO(data))
+    return image.resize((75, 75), Image.Resampling.LANCZOS).convert('1').tobytes()
+
+
+def _run_decode(func, data, repeat, results):
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    begin = time.perf_counter()
+    for _ in range(repeat):
+        func(data)
+    elapsed = (time.perf_counter() - begin) / repeat
+    results.put((elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline))
+
+
+def _measure_decode(func, data, repeat):
+    # each path runs in a fresh process so that peak RSS is not shared
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=_run_decode, args=(func, data, repeat, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def bench_decode(args):
+    """compare per-cover decode time and peak memory of the full and reduced-scale paths."""
+    if args.cover:
+        with open(args.cover, 'rb') as f:
+            data = f.read()
+    else:
+        buffer = io.BytesIO()
+        _synthetic_cover(args.size).save(buffer, 'JPEG')
+        data = buffer.getvalue()
+
+    print(f"cover of {len(data) // 1024} KiB, {args.repeat} decodes per path")
+    for name, func in (('full decode', _legacy_decode), ('reduced-scale', decode_artwork)):
+        elapsed, peak = _measure_decode(func, data, args.repeat)
+        print(f"  {name:<14} {elapsed * 1000:7.1f} ms/cover, peak RSS +{peak} KiB")
+
+
+def _synthetic_cover(size):
+    return Image.effect_mandelbrot((size, size), (-2, -1.5, 1, 1.5), 100).convert('RGB')
+
+
+def bench_dither(args):
+    """compare speed and output of the dithering modes at thumbnail size."""
+    if args.cover:
+        cover = Image.open(args.cover)
+    else:
+        cover = _synthetic_cover(args.size)
+    gray = cover.convert('L').resize(ARTWORK_SIZE, Image.Resampling.LANCZOS)
+    pixels = ARTWORK_SIZE[0] * ARTWORK_SIZE[1]
+
+    print(f"{ARTWORK_SIZE[0]}x{ARTWORK_SIZE[1]} thumbnail, {args.repeat} runs per mode")
+    for mode in ('pil-default',) + MODES:
+        begin = time.perf_counter()
+        for _ in range(args.repeat):
+            if mode == 'pil-default':
+                data = gray.convert('1').tobytes()
+            else:
+                data = dither(gray, mode)
+        elapsed = (time.perf_counter() - begin) / args.repeat
+        image = Image.frombytes('1', ARTWORK_SIZE, data)
+        black = 1 - image.convert('L').histogram()[255] / pixels
+        print(f"  {mode:<12} {elapsed * 1000:6.2f} ms, {black:5.1%} black")
+        if args.output:
+            os.makedirs(args.output, exist_ok=True)
+            image.save(os.path.join(args.output, f"{mode}.png"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    memory = commands.add_parser('memory', help=bench_memory.__doc__)
+    memory.add_argument('--count', type=int, default=200)
+    memory.add_argument('--size', type=int, default=640)
+    memory.set_defaults(func=bench_memory)
+
+    decode = commands.add_parser('decode', help=bench_decode.__doc__)
+    decode.add_argument('--cover', help="encoded cover to decode, a synthetic JPEG is used otherwise")
+    decode.add_argument('--size', type=int, default=640)
+    decode.add_argument('--repeat', type=int, default=20)
+    decode.set_defaults(func=bench_decode)
+
+    dithering = commands.add_parser('dither', help=bench_dither.__doc__)
+    dithering.add_argument('--cover', help="cover image, a synthetic one is used otherwise")
+    dithering.add_argument('--size', type=int, default=640)
+    dithering.add_argument('--repeat', type=int, default=100)
+    dithering.add_argument('--output', help="directory where each mode's output is saved")
+    dithering.set_defaults(func=bench_dither)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Small least-recently-used mapping, bounded by entry count and optionally by bytes."""
+
+    def __init__(self, maxsize=None, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.items = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        if key not in self.items:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self.items.move_to_end(key)
+        return self.items[key]
+
+    def put(self, key, value):
+        self.bytes -= self.sizes.get(key, 0)
+        self.items[key] = value
+        self.items.move_to_end(key)
+        self.sizes[key] = self.sizeof(value) if self.sizeof else 0
+        self.bytes += self.sizes[key]
+        self._evict()
+
+    def clear(self):
+        self.items.clear()
+        self.sizes.clear()
+        self.bytes = 0
+
+    def limit(self, maxbytes, sizeof):
+        """bound the cache to maxbytes, as measured by sizeof."""
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.sizes = {key: sizeof(value) for key, value in self.items.items()}
+        self.bytes = sum(self.sizes.values())
+        self._evict()
+
+    def _evict(self):
+        # the newest entry is kept even when it is larger than maxbytes alone
+        while self.items and (
+            (self.maxsize is not None and len(self.items) > self.maxsize)
+            or (self.maxbytes is not None and self.bytes > self.maxbytes and len(self.items) > 1)
+        ):
+            key, _ = self.items.popitem(last=False)
+            self.bytes -= self.sizes.pop(key)
+            self.evictions += 1
+
+    def __contains__(self, key):
+        return key in self.items
+
+    def __len__(self):
+        return len(self.items)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+
+
+class CommandScheduler:
+    """Debounce and merge bursts of taps in front of the Player.
+
+    Track skips are summed into a single playlist command sent once taps
+    stop for `delay` seconds. Album paging is summed the same way so only
+    the final album card is rendered. Volume changes are sent right away
+    then at most once per `volume_interval`, with the latest value.
+    """
+
+    def __init__(self, player, delay, volume_interval=0.25):
+        self.player = player
+        self.delay = delay
+
+        self.track_offset = 0
+        self.track_task = None
+        self.sending = False
+
+        self.page_offset = 0
+        self.page_at = 0
+
+        self.volume_interval = volume_interval
+        self.volume_target = None
+        self.volume_task = None
+
+    def skip(self, offset):
+        """queue a move of offset tracks."""
+        self.track_offset += offset
+        self.player.cancel_track_update()
+        if self.sending:
+            # picked up once the command in flight returns
+            return
+        if self.track_task is not None and not self.track_task.done():
+            self.track_task.cancel()
+        self.track_task = asyncio.create_task(self._flush_tracks())
+
+    async def _flush_tracks(self):
+        await asyncio.sleep(self.delay)
+        self.sending = True
+        try:
+            while self.track_offset:
+                offset, self.track_offset = self.track_offset, 0
+                logging.debug(f"skipping {offset:+d} tracks")
+                await self.player.skip(offset)
+        except Exception as e:
+            logging.error(f"Error while skipping tracks: {e}")
+        finally:
+            self.sending = False
+        self.player.schedule_track_update()
+
+    def page(self, offset):
+        """queue a move of offset albums in the selector."""
+        self.page_offset += offset
+        self.page_at = time.monotonic()
+
+    def settled_page(self):
+        """return the queued album offset once the taps have settled, else 0."""
+        if not self.page_offset or time.monotonic() - self.page_at < self.delay:
+            return 0
+        offset, self.page_offset = self.page_offset, 0
+        return offset
+
+    def set_volume(self, volume):
+        """queue an absolute volume, at most one command is sent per interval while it moves."""
+        self.volume_target = volume
+        if self.volume_task is None or self.volume_task.done():
+            self.volume_task = asyncio.create_task(self._flush_volume())
+
+    async def _flush_volume(self):
+        try:
+            while self.volume_target is not None:
+                volume, self.volume_target = self.volume_target, None
+                logging.debug(f"volume {volume}")
+                await self.player.set_volume(volume)
+                # later moves are merged, the echo of this one arrives meanwhile
+                await asyncio.sleep(self.volume_interval)
+        except Exception as e:
+            logging.error(f"Error while setting the volume: {e}")
+            self.volume_target = None
+
+    @property
+    def volume_pending(self):
+        """whether a volume change is being sent, the player volume lags behind it."""
+        return self.volume_task is not None and not self.volume_task.done()
+
+    @property
+    def pending(self):
+        """whether commands are queued or being sent."""
+        return bool(self.page_offset or self.track_offset or self.sending or self.volume_pending)
+
+    def cancel(self):
+        """drop queued commands, e.g. when leaving a screen."""
+        self.page_offset = 0
+        if self.track_task is not None and not self.sending:
+            self.track_task.cancel()
+        self.track_offset = 0
@@ -8,5 +8,36 @@ SPOTIFY_USER = os.getenv("SPOTIFY_USER", "default")
 
 PARTIAL_UPDATE_COUNT = int(os.getenv("PARTIAL_UPDATE_COUNT", 100))
 FULL_REFRESH_TIME = int(os.getenv("FULL_REFRESH_TIME", 12))
+GHOSTING_BUDGET = float(os.getenv("GHOSTING_BUDGET", 20))  # full-screen changes between full refreshes
+FULL_REFRESH_IDLE = float(os.getenv("FULL_REFRESH_IDLE", 5))
+
+COMMAND_DEBOUNCE = float(os.getenv("COMMAND_DEBOUNCE", 0.3))
+VOLUME_INTERVAL = float(os.getenv("VOLUME_INTERVAL", 0.25))  # seconds between volume commands while dragging
+IDLE_TIMEOUT = float(os.getenv("IDLE_TIMEOUT", 60))  # seconds without activity before idling, 0 never idles
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 10))  # seconds between progress bar redraws, 0 hides it
+
+ARTWORK_WORKERS = int(os.getenv("ARTWORK_WORKERS", 1))
+ARTWORK_CACHE_SIZE = int(os.getenv("ARTWORK_CACHE_SIZE", 32))
+ARTWORK_MAX_AGE = int(os.getenv("ARTWORK_MAX_AGE", 3600))  # seconds before a cached cover is revalidated
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", 2))
+DITHER_MODE = os.getenv("DITHER_MODE", "bayer").lower()  # bayer, diffusion or threshold
+MARQUEE_STEP = int(os.getenv("MARQUEE_STEP", 0))  # pixels per step of the long track lines, 0 disables scrolling
+MARQUEE_DUTY = float(os.getenv("MARQUEE_DUTY", 0.5))  # largest share of the panel time spent scrolling
+
+MEMORY_BUDGET = float(os.getenv("MEMORY_BUDGET", 4))  # MiB shared by the artwork, render and text caches
+MEMORY_TRACE_FRAMES = int(os.getenv("MEMORY_TRACE_FRAMES", 0))  # tracemalloc frames, 0 disables tracing
+MEMORY_REPORT_INTERVAL = float(os.getenv("MEMORY_REPORT_INTERVAL", 0))  # seconds, 0 reports on SIGUSR1 only
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.expanduser("~/.cache/micro_player"))
+LAST_SCREEN_FILE = os.path.join(CACHE_DIR, "last_screen.bin")
+FAVORITES_FILE = os.path.join(CACHE_DIR, "favorites.bin")
+LIBRARY_DIR = os.path.join(CACHE_DIR, "library")
+SPI_SETTINGS_FILE = os.getenv("SPI_SETTINGS_FILE", os.path.join(CACHE_DIR, "spi.json"))  # written by the SPI calibration
+FAVORITES_RESYNC_INTERVAL = float(os.getenv("FAVORITES_RESYNC_INTERVAL", 3600))  # seconds between favorites syncs
+
+TRACE_FILE = os.getenv("TRACE_FILE", "")  # touch and LMS events are recorded there when set
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))  # /metrics and /health are served when set
+METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
 
 LOG_LEVEL = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
@@ -2,86 +2,244 @@
 # -*- coding:utf-8 -*-
 import logging
 import asyncio
-from datetime import timedelta, datetime
+import time
+from functools import cached_property
 
 from PIL import Image, ImageDraw, ImageFont
-from lib import epd2in13_V4  # eInk display stuff
+from lib.epd2in13_V4_async import AsyncEPD  # eInk display stuff
 
 from lib import gt1151  # eInk touch stuff
 from . import get_asset_path
+from .artwork import pack_artwork, unpack_artwork
+from .cache import LRUCache
+from .index import LETTERS
+from .refresh import changed_pixels, panel_window, patch_window, window_data, window_union
+from .splash import save_last_screen
 
 
 class EinkDisplay:
-    def __init__(self, full_refresh_time, partial_update_count):
+    QUEUE_ROWS = 5
+    QUEUE_ROW_HEIGHT = 24
+    VOLUME_BOX = (80, 82, 246, 92)  # volume slider of the player screen, between the track and the buttons
+    PROGRESS_BOX = (2, 82, 74, 92)  # track progress, under the artwork
+    TRACK_LINES = ((80, 5), (80, 30), (80, 55))  # title, album and artist on the player screen
+    KIND_LABELS = {None: "all", 'album': "albums", 'playlist': "playlists",
+                   'library_album': "library", 'library_artist': "artists"}
+
+    def __init__(self, refresh_policy, epd=None, splash=None, sleep_delay=2, trace=None):
         # Initialisation screen
-        self.partial_update_count = partial_update_count
-        self.full_refresh_delta = timedelta(hours=full_refresh_time)
-        self.epd = epd2in13_V4.EPD()
-        self.font = ImageFont.truetype(get_asset_path('Font.ttc'), 18)
-        self.player = Image.open(get_asset_path('player.bmp'))
-        self.menu = Image.open(get_asset_path('menu.bmp'))
-        self.selector = Image.open(get_asset_path('selector.bmp'))
+        self.refresh_policy = refresh_policy
+        self.epd = epd or AsyncEPD()
+        # back buffer: frames are composed here while the panel shows the front one
         self.canvas = Image.new('1', (self.epd.height, self.epd.width), 255)
-        self.baseImage = self.menu
-        self.canvas.paste(self.baseImage)
 
         # Initialisation du tactile
         self.gt = gt1151.GT1151()
         self.GT_Dev = gt1151.GT_Development()
         self.GT_Old = gt1151.GT_Development()
         self.gt.GT_Init()
+        self.trace = trace  # trace.TraceWriter recording the touch reports
 
-        # Async task for touch check
+        # Async task for touch check, polling only while not idle
+        self.polling = True
+        self.touched = asyncio.Event()  # set by the touch interrupt
+        loop = asyncio.get_running_loop()
+        self.gt.on_touch(lambda: loop.call_soon_threadsafe(self._touch_interrupt))
         self.stop_touch_check = asyncio.Event()
         self.touch_task = asyncio.create_task(self.touch_check())
 
+        # rendered text strips by text, bounded by the memory budget
+        self.texts = LRUCache(64)
+        self.volume = None  # volume drawn on the player screen
+        self.progress = None  # played fraction of the track drawn on the player screen
+        self.marquee = None  # marquee.Marquee scrolling the track lines too long for the screen
+
         # screen Refresh Management
-        self.screen = 0  # 0 = Menu , 1 =  album selector, 2 = Player
+        self.screen = 0  # 0 = Menu , 1 =  album selector, 2 = Player, 3 = jump to letter, 4 = play queue
 
         # Refresh Management
-        self.refreshCounter = 0
-        self.nextRefresh = datetime.now()
+        self.last_buffer = splash  # front buffer: packed frame last handed to the panel
+        self.needs_full_refresh = splash is None  # the splash leaves the panel full-refreshed
+
+        # Frames are sent by a presenter task as soon as BUSY releases; a frame
+        # queued while the panel is busy replaces the one waiting before it.
+        self.sleep_delay = sleep_delay
+        self.pending = None
+        self.pending_full = False
+        self.pending_window = None  # panel window of a pending region frame, None for the whole panel
+        self.frame_ready = asyncio.Event()
+        self.last_frame_at = 0.0
+        self.partial_seconds = 0.3  # measured length of a partial waveform, averaged
+        self.asleep = False
+        self.recovering = False  # after a failed frame the panel RAM is unknown, the next one is sent whole
+        self.present_task = asyncio.create_task(self.present_frames())
+
+    # Assets are loaded on first use to keep them out of the startup path.
+    @cached_property
+    def font(self):
+        return ImageFont.truetype(get_asset_path('Font.ttc'), 18)
+
+    @cached_property
+    def fallback_artwork(self):
+        """drawn instead of a missing or not yet downloaded cover."""
+        return unpack_artwork(pack_artwork(Image.open(get_asset_path('fallback.png'))))
+
+    @cached_property
+    def player(self):
+        return Image.open(get_asset_path('player.bmp'))
+
+    @cached_property
+    def menu(self):
+        return Image.open(get_asset_path('menu.bmp'))
+
+    @cached_property
+    def selector(self):
+        return Image.open(get_asset_path('selector.bmp'))
 
     def full_refresh(self):
-        self.refreshCounter = 0
-        self.epd.init(self.epd.FULL_UPDATE)
-        self.epd.displayPartBaseImage(self.epd.getbuffer(self.baseImage))
-        self.epd.sleep()
-        self.partial_refresh()
-
-    def partial_refresh(self):
-        self.refreshCounter += 1
-        self.epd.init(self.epd.PART_UPDATE)
-        self.epd.displayPartial(self.epd.getbuffer(self.canvas))
-        self.epd.sleep()
+        buffer = bytes(self.epd.getbuffer(self.canvas))
+        self.queue_frame(buffer, full=True)
+        self.needs_full_refresh = False
+        self.refresh_policy.record_full()
+
+    def partial_refresh(self, buffer=None):
+        """queue the canvas, or an already packed buffer of it, for the panel."""
+        buffer = bytes(buffer or self.epd.getbuffer(self.canvas))
+        area = changed_pixels(self.last_buffer, buffer)
+        if not area:
+            self.refresh_policy.record_skipped()
+            return
+        self.queue_frame(buffer)
+        self.refresh_policy.record_partial(area)
+
+    def region_refresh(self, box):
+        """queue the canvas, writing only the box to the panel RAM when nothing changed outside of it."""
+        buffer = bytes(self.epd.getbuffer(self.canvas))
+        window = panel_window(box)
+        if self.last_buffer is None or patch_window(self.last_buffer, buffer, window) != buffer:
+            self.partial_refresh(buffer)
+            return
+        area = changed_pixels(self.last_buffer, buffer)
+        if not area:
+            self.refresh_policy.record_skipped()
+            return
+        self.queue_frame(buffer, window=window)
+        self.refresh_policy.record_partial(area, region=True)
+
+    def queue_frame(self, buffer, full=False, window=None):
+        self.last_frame_at = time.monotonic()
+        self.last_buffer = buffer
+        # a frame still waiting is replaced, the windows of both must be written
+        if self.pending is None:
+            self.pending_window = window
+        elif self.pending_window is not None and window is not None:
+            self.pending_window = window_union(self.pending_window, window)
+        else:
+            self.pending_window = None
+        self.pending = buffer
+        self.pending_full = self.pending_full or full
+        self.frame_ready.set()
+
+    async def present_frames(self):
+        """Send queued frames, overlapping the waveform with the next frame composition."""
+        while True:
+            try:
+                await self.present_frame()
+            except Exception as e:
+                logging.error(f"Error while sending frame: {e}")
+                if not self.recovering and self.pending is None and self.last_buffer is not None:
+                    # try the latest frame once more, whole
+                    self.pending = self.last_buffer
+                    self.frame_ready.set()
+                self.recovering = True
+                await asyncio.sleep(1)
+
+    async def present_frame(self):
+        """send the next frame, or put the panel to sleep when none comes."""
+        if self.asleep:
+            await self.frame_ready.wait()
+        else:
+            try:
+                await asyncio.wait_for(self.frame_ready.wait(), self.sleep_delay)
+            except asyncio.TimeoutError:
+                await self.epd.sleep()
+                self.asleep = True
+                return
+
+        # the newest frame is taken once the previous waveform is over, the
+        # reset of the next frame wakes a sleeping panel up without it
+        if not self.asleep:
+            await self.epd.ReadBusy()
+        self.frame_ready.clear()
+        buffer, full, window = self.pending, self.pending_full, self.pending_window
+        self.pending, self.pending_full, self.pending_window = None, False, None
+        if buffer is None:
+            return
+        full = full or self.recovering
+        if full:
+            await self.epd.init(self.epd.FULL_UPDATE)
+            await self.epd.displayPartBaseImage(buffer)
+        elif window is not None:
+            first, last, top, bottom = window
+            await self.epd.displayPartialWindow(window_data(buffer, window), first * 8, top,
+                                                last * 8 - 1, bottom - 1, wait=False)
+        else:
+            await self.epd.displayPartial(buffer, wait=False)
+        self.asleep = self.recovering = False
+        if not full:
+            begin = time.monotonic()
+            await self.epd.ReadBusy()
+            self.partial_seconds += (time.monotonic() - begin - self.partial_seconds) / 4
+
+    async def flush(self, timeout=30):
+        """wait until every queued frame is on the panel, unless the presenter is gone."""
+        deadline = time.monotonic() + timeout
+        while self.frame_ready.is_set() and not self.present_task.done() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        if not self.asleep:
+            await self.epd.ReadBusy()
 
     def refresh_if_needed(self):
         """refresh screen if necessary."""
-
-        if datetime.now() > self.nextRefresh:
+        if self.needs_full_refresh or self.refresh_policy.should_full_refresh():
             logging.debug("refresh screen...")
             self.full_refresh()
-            # next refresh screen
-            self.nextRefresh = datetime.now() + self.full_refresh_delta
-
-        # After multiple partial refresh, do a full refresh
-        if self.refreshCounter >= self.partial_update_count:
-            self.refreshCounter = 0
 
     def update_current_track(self, song, album, artist, artwork):
         """update current track."""
         self.canvas.paste(self.player)
         self.draw_song(song, album, artist, artwork)
+        self.draw_bars()
         self.partial_refresh()
 
+    def text_strip(self, text):
+        """text rendered once as a 1-bit mask, ink set."""
+        strip = self.texts.get(text)
+        if strip is None:
+            _, _, right, bottom = self.font.getbbox(text)
+            strip = Image.new('1', (max(right, 1), max(bottom, 1)), 0)
+            ImageDraw.Draw(strip).text((0, 0), text, font=self.font, fill=1)
+            self.texts.put(text, strip)
+        return strip
+
+    def draw_text(self, position, text, canvas=None, max_width=None, offset=0):
+        """draw text in black, keeping the background around the glyphs.
+
+        With max_width, only that many pixels of the text from offset are drawn.
+        """
+        strip = self.text_strip(text)
+        if max_width is not None and (offset or strip.width > max_width):
+            strip = strip.crop((offset, 0, offset + max_width, strip.height))
+        (canvas or self.canvas).paste(0, position, strip)
+
     def draw_song(self, song, album, artist, artwork):
         """draw song information."""
-        artwork = artwork.resize((75, 75), Image.Resampling.LANCZOS).convert('1')
-        self.canvas.paste(artwork, (2, 2))
-        draw = ImageDraw.Draw(self.canvas)
-        draw.text((80, 5), song, font=self.font, fill=0)
-        draw.text((80, 30), album, font=self.font, fill=0)
-        draw.text((80, 55), artist, font=self.font, fill=0)
+        self.canvas.paste(unpack_artwork(artwork) if artwork else self.fallback_artwork, (2, 2))
+        lines = list(zip(self.TRACK_LINES, (song, album, artist)))
+        for position, text in lines:
+            self.draw_text(position, text)
+        if self.marquee is not None:
+            self.marquee.start(lines)
 
     def draw_play(self):
         # Define the size and position of the pause button (two vertical bars)
@@ -121,42 +279,146 @@ class EinkDisplay:
         draw.rectangle(left_bar, fill='black')
         draw.rectangle(right_bar, fill='black')
 
-    def draw_album(self, album, artist, artwork):
-        """draw album information."""
-        artwork = artwork.resize((75, 75), Image.Resampling.LANCZOS).convert('1')
-        self.canvas.paste(artwork, (2, 2))
+    @staticmethod
+    def bar_level(box, fraction):
+        """last column filled by a bar over box at fraction."""
+        x0, _, x1, _ = box
+        return x0 + round((x1 - x0) * min(max(fraction, 0), 1))
+
+    def draw_bar(self, box, fraction):
+        x0, y0, x1, y1 = box
         draw = ImageDraw.Draw(self.canvas)
-        draw.text((80, 20), album, font=self.font, fill=0)
-        draw.text((80, 45), artist, font=self.font, fill=0)
+        draw.rectangle((x0, y0, x1 - 1, y1 - 1), fill=255, outline=0)
+        level = self.bar_level(box, fraction)
+        if level > x0:
+            draw.rectangle((x0, y0, level - 1, y1 - 1), fill=0)
+
+    def draw_bars(self):
+        """draw the volume and progress bars again once the player screen is pasted."""
+        if self.volume is not None:
+            self.draw_volume(self.volume)
+        if self.progress is not None:
+            self.draw_progress(self.progress)
+
+    def draw_volume(self, volume):
+        """draw the volume slider, filled up to volume percent."""
+        self.volume = volume
+        self.draw_bar(self.VOLUME_BOX, volume / 100)
+
+    def draw_progress(self, fraction):
+        self.progress = fraction
+        self.draw_bar(self.PROGRESS_BOX, fraction)
+
+    def show_progress(self, fraction):
+        """redraw the progress bar alone, once it moved by a pixel at least."""
+        if self.progress is not None and self.bar_level(self.PROGRESS_BOX, fraction) == self.bar_level(
+                self.PROGRESS_BOX, self.progress):
+            return
+        self.draw_progress(fraction)
+        self.region_refresh(self.PROGRESS_BOX)
+
+    def show_volume(self, volume):
+        """redraw the volume slider alone."""
+        self.draw_volume(volume)
+        self.region_refresh(self.VOLUME_BOX)
+
+    def volume_at(self, x):
+        """volume set by a touch at canvas column x of the slider."""
+        x0, _, x1, _ = self.VOLUME_BOX
+        return min(max(round((x - x0) * 100 / (x1 - 1 - x0)), 0), 100)
+
+    def draw_album(self, album, artist, artwork, canvas=None):
+        """draw album information."""
+        canvas = canvas or self.canvas
+        canvas.paste(unpack_artwork(artwork) if artwork else self.fallback_artwork, (2, 2))
+        self.draw_text((80, 20), album, canvas)
+        self.draw_text((80, 45), artist, canvas)
+        # jump to letter button, bottom right
+        self.draw_text((214, 98), "A-Z", canvas)
 
     def show_player(self):
         """show player."""
         self.screen = 2
-        self.baseImage = self.player
         self.canvas.paste(self.player)
+        if self.marquee is not None:
+            self.marquee.stop()
+        self.draw_bars()
         self.partial_refresh()
 
     def show_selector(self):
         """show album selector."""
         self.screen = 1
-        self.baseImage = self.selector
         self.canvas.paste(self.selector)
 
         self.partial_refresh()
 
-    def show_menu(self):
-        """show menu."""
+    def show_menu(self, player_name=None):
+        """show menu, with the name of the controlled player under the icons."""
         self.screen = 0
-        self.baseImage = self.menu
         self.canvas.paste(self.menu)
+        if player_name:
+            label = f"< {player_name} >"
+            x = max((self.canvas.width - self.text_strip(label).width) // 2, 2)
+            self.draw_text((x, 96), label, max_width=self.canvas.width - 4)
         self.partial_refresh()
 
-    def show_album(self, album, artist, artwork):
-        """show album."""
-        self.canvas.paste(self.selector)
-        self.draw_album(album, artist, artwork)
+    def render_album(self, album, artist, artwork):
+        """render an album card off screen, returns the frame and its packed buffer."""
+        frame = self.selector.copy()
+        self.draw_album(album, artist, artwork, frame)
+        return frame, self.epd.getbuffer(frame)
+
+    def show_album(self, album, artist, artwork, rendered=None):
+        """show album, using a frame from render_album when available."""
+        if rendered is None:
+            self.canvas.paste(self.selector)
+            self.draw_album(album, artist, artwork)
+            self.partial_refresh()
+        else:
+            frame, buffer = rendered
+            self.canvas.paste(frame)
+            self.partial_refresh(buffer)
+
+    def show_jump(self, letters, order, kind):
+        """show the jump to letter screen, letters without favorites are crossed out."""
+        self.screen = 3
+        self.canvas.paste(255, (0, 0, self.canvas.width, self.canvas.height))
+        draw = ImageDraw.Draw(self.canvas)
+        for position, letter in enumerate(LETTERS):
+            x0, y0, x1, y1 = self.jump_cell(position)
+            draw.rectangle((x0, y0, x1, y1), outline=0)
+            draw.text((x0 + 8, y0 + 5), letter, font=self.font, fill=0)
+            if letter not in letters:
+                draw.line((x0, y1, x1, y0), fill=0)
+        buttons = ("by " + order, self.KIND_LABELS[kind], "back")
+        for position, label in enumerate(buttons):
+            draw.text((position * 84 + 4, 98), label, font=self.font, fill=0)
+        self.partial_refresh()
+
+    def show_queue(self, tracks, current):
+        """show (index, title, artist) tracks of the play queue, marking the playing one."""
+        self.screen = 4
+        self.canvas.paste(255, (0, 0, self.canvas.width, self.canvas.height))
+        draw = ImageDraw.Draw(self.canvas)
+        for row, (index, title, artist) in enumerate(tracks[:self.QUEUE_ROWS]):
+            y = row * self.QUEUE_ROW_HEIGHT
+            if index == current:
+                draw.polygon([(2, y + 6), (10, y + 12), (2, y + 18)], fill=0)
+            self.draw_text((14, y + 2), f"{index + 1}. {title} - {artist}", max_width=194)
+        # scroll up, back and scroll down buttons on the right
+        draw.line((212, 0, 212, self.canvas.height), fill=0)
+        draw.polygon([(222, 30), (231, 12), (240, 30)], fill=0)
+        draw.polygon([(222, 61), (240, 52), (240, 70)], fill=0)
+        draw.polygon([(222, 92), (231, 110), (240, 92)], fill=0)
         self.partial_refresh()
 
+    @staticmethod
+    def jump_cell(position):
+        """box of a letter on the jump screen: 9 columns, 3 rows."""
+        x0 = (position % 9) * 27 + 4
+        y0 = (position // 9) * 31
+        return x0, y0, x0 + 26, y0 + 30
+
     def show_play_pause(self, is_playing=True):
         if is_playing:
             self.draw_pause()
@@ -170,12 +432,18 @@ class EinkDisplay:
 
     def read_touch(self):
         """Reads touch inputs and returns the corresponding event."""
+        scanned = self.GT_Dev.Touch
+        if scanned:
+            self.GT_Dev.TouchpointFlag = 0  # set again only by a new report
         self.gt.GT_Scan(self.GT_Dev, self.GT_Old)
+        if scanned and self.GT_Dev.TouchpointFlag and self.trace is not None:
+            self.trace.touch(self.GT_Dev.X[0], self.GT_Dev.Y[0], self.GT_Dev.S[0])
 
         if self.GT_Old.X[0] == self.GT_Dev.X[0] and self.GT_Old.Y[0] == self.GT_Dev.Y[0]:
             return None
 
         if self.GT_Dev.TouchpointFlag:
+            self.refresh_policy.interaction()
 
             # reset
             self.GT_Dev.TouchpointFlag = 0
@@ -185,7 +453,10 @@ class EinkDisplay:
 
             # Menu
             if self.screen == 0:
-                if 10 < self.GT_Dev.X[0] < 112 and 10 < self.GT_Dev.Y[0] < 120:
+                if self.GT_Dev.X[0] >= 95:
+                    # player name, under the icons
+                    return 'next_player'
+                elif 10 < self.GT_Dev.X[0] < 112 and 10 < self.GT_Dev.Y[0] < 120:
                     return 'selector'
                 elif 29 < self.GT_Dev.X[0] < 92 and 140 < self.GT_Dev.Y[0] < 240:
                     return 'player'
@@ -201,8 +472,26 @@ class EinkDisplay:
                 elif 80 <= self.GT_Dev.X[0] <= 122 and 40 <= self.GT_Dev.Y[0] <= 90:
                     return 'next_album'
 
+                elif 80 <= self.GT_Dev.X[0] <= 122 and 0 <= self.GT_Dev.Y[0] <= 40:
+                    return 'jump'
+
+            elif self.screen == 3:
+                # touch coordinates are rotated from the canvas ones
+                x, y = self.canvas.width - self.GT_Dev.Y[0], self.GT_Dev.X[0]
+                if y >= 93:
+                    return ('jump_order', 'jump_kind', 'jump_back')[min(x // 84, 2)]
+                for position, letter in enumerate(LETTERS):
+                    x0, y0, x1, y1 = self.jump_cell(position)
+                    if x0 <= x <= x1 and y0 <= y <= y1:
+                        return 'letter:' + letter
+
             elif self.screen == 2:
-                if 80 <= self.GT_Dev.X[0] <= 122 and 155 <= self.GT_Dev.Y[0] <= 200:
+                x, y = self.canvas.width - self.GT_Dev.Y[0], self.GT_Dev.X[0]
+                x0, y0, x1, y1 = self.VOLUME_BOX
+                if x0 - 4 <= x <= x1 + 4 and y0 - 2 <= y <= y1 + 1:
+                    # taps and drags on the slider, above the buttons
+                    return f'volume:{self.volume_at(x)}'
+                elif 80 <= self.GT_Dev.X[0] <= 122 and 155 <= self.GT_Dev.Y[0] <= 200:
                     return 'return_menu'
                 elif 80 <= self.GT_Dev.X[0] <= 122 and 210 <= self.GT_Dev.Y[0] <= 250:
                     return 'selector'
@@ -212,23 +501,51 @@ class EinkDisplay:
                     return 'previous_track'
                 elif 80 <= self.GT_Dev.X[0] <= 122 and 47 <= self.GT_Dev.Y[0] <= 92:
                     return 'play_pause'
-
-    def cleanup(self):
-        self.epd.init(self.epd.FULL_UPDATE)
-        self.epd.Clear(0xFF)
-        self.epd.sleep()
+                elif self.GT_Dev.X[0] < 80 and self.GT_Dev.Y[0] <= 170:
+                    # track information, right of the artwork
+                    return 'queue'
+
+            elif self.screen == 4:
+                x, y = self.canvas.width - self.GT_Dev.Y[0], self.GT_Dev.X[0]
+                if x >= 212:
+                    return 'queue_up' if y < 40 else 'queue_back' if y < 80 else 'queue_down'
+
+    async def cleanup(self):
+        save_last_screen(self.epd.getbuffer(self.canvas))
+        await self.flush()
+        self.present_task.cancel()
+        await self.epd.init(self.epd.FULL_UPDATE)
+        await self.epd.Clear(0xFF)
+        await self.epd.sleep()
+
+    def _touch_interrupt(self):
+        # the INT pulse may be over before the next poll, GT_Scan clears Touch once read
+        self.GT_Dev.Touch = 1
+        self.touched.set()
+
+    def set_polling(self, polling):
+        """poll the touch INT pin, or only wait for its interrupt."""
+        self.polling = polling
+        if polling:
+            self.touched.set()  # wakes touch_check up
+        else:
+            self.touched.clear()
 
     async def touch_check(self):
         """Touch event management coroutine."""
         while not self.stop_touch_check.is_set():
+            if not self.polling:
+                await self.touched.wait()
+                self.touched.clear()
+                continue
+
             if self.gt.digital_read(self.gt.INT) == 0:
                 self.GT_Dev.Touch = 1
-            else:
-                self.GT_Dev.Touch = 0
 
             await asyncio.sleep(0.05)
 
     async def stop(self):
         """Stop Touch task"""
         self.stop_touch_check.set()
+        self.touched.set()
         await self.touch_task
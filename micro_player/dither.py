@@ -0,0 +1,50 @@
+import numpy as np
+from PIL import Image, ImageOps
+
+MODES = ('bayer', 'diffusion', 'threshold')
+
+
+def _bayer_matrix(order):
+    matrix = np.zeros((1, 1), dtype=np.uint16)
+    for _ in range(order):
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    # thresholds centered in each of the 64 levels, scaled to 0..255
+    return ((matrix.astype(np.float32) + 0.5) * 256 / matrix.size).astype(np.uint8)
+
+
+BAYER_8X8 = _bayer_matrix(3)
+
+
+def _pack(mask):
+    """pack a boolean white mask into PIL's raw '1' layout."""
+    return np.packbits(mask, axis=1).tobytes()
+
+
+def bayer(pixels):
+    """ordered dithering with an 8x8 Bayer matrix."""
+    height, width = pixels.shape
+    thresholds = np.tile(BAYER_8X8, (height // 8 + 1, width // 8 + 1))[:height, :width]
+    return _pack(pixels > thresholds)
+
+
+def threshold(pixels, level=128):
+    """plain threshold, the crispest rendering for text and line art."""
+    return _pack(pixels >= level)
+
+
+def diffusion(image):
+    """Floyd-Steinberg error diffusion, done by PIL's C implementation."""
+    return image.convert('1', dither=Image.Dither.FLOYDSTEINBERG).tobytes()
+
+
+def dither(image, mode):
+    """reduce a grayscale image to packed 1-bit bytes with the given mode."""
+    image = ImageOps.autocontrast(image.convert('L'), cutoff=1)
+    if mode == 'diffusion':
+        return diffusion(image)
+    pixels = np.asarray(image)
+    if mode == 'threshold':
+        return threshold(pixels)
+    if mode == 'bayer':
+        return bayer(pixels)
+    raise ValueError(f"unknown dithering mode {mode}, expected one of {', '.join(MODES)}")
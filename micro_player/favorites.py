@@ -0,0 +1,142 @@
+import logging
+import os
+import struct
+import sys
+
+from .lms import Album
+
+MAGIC = b'MPF1'
+HEADER = struct.Struct('<4sI')
+STRING = struct.Struct('<H')
+THUMBNAIL = struct.Struct('<H')
+
+
+def _write_string(f, value):
+    data = value.encode()
+    f.write(STRING.pack(len(data)))
+    f.write(data)
+
+
+def _read_string(view, offset):
+    (length,) = STRING.unpack_from(view, offset)
+    offset += STRING.size
+    return bytes(view[offset:offset + length]).decode(), offset + length
+
+
+def save_snapshot(path, albums):
+    """persist favorites metadata, URLs and packed thumbnails."""
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(albums)))
+            for album in albums:
+                for value in (album.kind, album.album, album.artist, album.url, album.icon):
+                    _write_string(f, value)
+                thumbnail = album.artwork or b''
+                f.write(THUMBNAIL.pack(len(thumbnail)))
+                f.write(thumbnail)
+        os.replace(tmp, path)
+        logging.debug(f"{len(albums)} favorites saved to {path}")
+    except OSError as e:
+        logging.warning(f"unable to save favorites snapshot: {e}")
+
+
+def load_snapshot(path):
+    """load favorites saved by save_snapshot, or None if there is no usable snapshot."""
+    try:
+        with open(path, 'rb') as f:
+            view = memoryview(f.read())
+    except OSError:
+        return None
+
+    try:
+        magic, count = HEADER.unpack_from(view, 0)
+        if magic != MAGIC:
+            raise ValueError("bad magic")
+        offset = HEADER.size
+        albums = []
+        for _ in range(count):
+            values = []
+            for _ in range(5):
+                value, offset = _read_string(view, offset)
+                values.append(value)
+            (length,) = THUMBNAIL.unpack_from(view, offset)
+            offset += THUMBNAIL.size
+            artwork = bytes(view[offset:offset + length]) if length else None
+            offset += length
+            kind, album, artist, url, icon = values
+            albums.append(Album(artist=artist, album=album, artwork=artwork, url=url, icon=icon, kind=kind))
+    except (struct.error, ValueError) as e:
+        logging.warning(f"ignoring corrupted favorites snapshot {path}: {e}")
+        return None
+
+    logging.debug(f"{len(albums)} favorites loaded from {path}")
+    return albums
+
+
+def merge_favorites(current, live):
+    """apply the live favorites list onto the current one, keeping known entries.
+
+    Entries are matched by favorites url. Returns the merged list, the
+    entries that need their artwork (new ones, with a new cover or whose
+    cover failed to download) and whether anything changed.
+    """
+    known = {album.url: album for album in current}
+    merged = []
+    added = []
+    stale = []
+    updated = 0
+    for item in live:
+        album = known.get(item.url)
+        if album is None:
+            album = item
+            added.append(album)
+        else:
+            if (album.album, album.artist, album.icon, album.kind) != (item.album, item.artist, item.icon, item.kind):
+                updated += 1
+            if album.icon != item.icon or (album.artwork is None and item.icon):
+                stale.append(album)
+            album.album = item.album
+            album.artist = item.artist
+            album.icon = item.icon
+            album.kind = item.kind
+        merged.append(album)
+
+    live_urls = {album.url for album in merged}
+    removed = sum(1 for album in current if album.url not in live_urls)
+    kept = [album.url for album in merged if album.url in known]
+    reordered = kept != [album.url for album in current if album.url in live_urls]
+    logging.debug(f"favorites diff: {len(added)} added, {removed} removed, {updated} updated, reordered: {reordered}")
+    return merged, added + stale, bool(added or removed or updated or reordered)
+
+
+async def revalidate_favorites(player, albums):
+    """diff albums against the live Spotty menus.
+
+    Only new entries, entries whose cover changed and those still missing
+    their cover have their artwork downloaded. Returns the updated list, or None if the favorites did not
+    change or could not be listed: an empty or failed listing, e.g. while
+    Spotty starts, never removes favorites.
+    """
+    try:
+        live = await player.get_spotify_favorite(with_artwork=False)
+    except Exception as e:
+        logging.warning(f"favorites not synchronized: {e}")
+        return None
+    if not live:
+        logging.warning("no favorites listed by Spotty, keeping the known ones")
+        return None
+    merged, needs_artwork, changed = merge_favorites(albums, live)
+    await player.fetch_artwork(needs_artwork)
+    # a cover downloaded at last is worth saving too
+    return merged if changed or any(album.artwork for album in needs_artwork) else None
+
+
+def favorites_footprint(albums):
+    """approximate memory held by the favorites list, in bytes."""
+    size = sys.getsizeof(albums)
+    for album in albums:
+        size += sys.getsizeof(album)
+        size += sum(sys.getsizeof(getattr(album, name)) for name in Album.__slots__)
+    return size
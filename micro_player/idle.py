@@ -0,0 +1,69 @@
+import asyncio
+import logging
+import time
+
+
+class IdleMonitor:
+    """Low power state entered after `timeout` seconds without activity.
+
+    While idle the main loop and the touch polling are suspended until a
+    wake event is set. Idle CPU use and the delay from wake up to the next
+    frame are measured.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.last_activity = time.monotonic()
+        self.woken_at = None
+        self.awake = asyncio.Event()  # cleared while idle, for the periodic tasks to pause
+        self.awake.set()
+        self.metrics = {
+            'idle_periods': 0,
+            'idle_seconds': 0.0,
+            'idle_cpu_seconds': 0.0,
+            'wake_latency_last': 0.0,
+            'wake_latency_max': 0.0,
+        }
+
+    def activity(self):
+        self.last_activity = time.monotonic()
+
+    @property
+    def expired(self):
+        return self.timeout > 0 and time.monotonic() - self.last_activity >= self.timeout
+
+    async def sleep_until(self, *events, timeout=None):
+        """wait, without polling, until one of events is set or timeout seconds passed.
+
+        Returns whether an event woke it up, only those count as activity.
+        """
+        begin, cpu = time.monotonic(), time.process_time()
+        waiters = [asyncio.create_task(event.wait()) for event in events]
+        self.awake.clear()
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self.awake.set()
+            for waiter in waiters:
+                waiter.cancel()
+        now = time.monotonic()
+        duration, cpu = now - begin, time.process_time() - cpu
+        self.metrics['idle_periods'] += 1
+        self.metrics['idle_seconds'] += duration
+        self.metrics['idle_cpu_seconds'] += cpu
+        logging.debug(f"idle for {duration:.0f}s, cpu {cpu / max(duration, 1e-3):.2%}")
+        if not done:
+            return False
+        self.woken_at = now
+        self.activity()
+        return True
+
+    def frame_shown(self, shown_at):
+        """record the wake up latency once the first frame after it is queued."""
+        if self.woken_at is None or shown_at < self.woken_at:
+            return
+        latency = shown_at - self.woken_at
+        self.woken_at = None
+        self.metrics['wake_latency_last'] = latency
+        self.metrics['wake_latency_max'] = max(self.metrics['wake_latency_max'], latency)
+        logging.debug(f"woke up in {latency * 1000:.0f} ms")
@@ -0,0 +1,52 @@
+import bisect
+import unicodedata
+
+LETTERS = "#ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+ORDERS = ('title', 'artist')
+KINDS = (None, 'album', 'playlist', 'library_album', 'library_artist')  # None shows every favorite
+LIBRARY_KINDS = ('library_album', 'library_artist')  # browsed from the LMS library, not the favorites
+
+
+def initial(text):
+    """index letter of a text: its first letter without accent, or # for anything else."""
+    for char in unicodedata.normalize('NFKD', text.strip().upper()):
+        if 'A' <= char <= 'Z':
+            return char
+        if not unicodedata.combining(char):
+            return '#'
+    return '#'
+
+
+def _sort_key(text):
+    return (LETTERS.index(initial(text)), text.casefold())
+
+
+class FavoritesIndex:
+    """Sorted views over the favorites, built once per sync.
+
+    A view is the list of favorites of one kind ordered by title, or grouped
+    by artist, along with the index letter of each entry for jumps.
+    """
+
+    def __init__(self, albums):
+        self.albums = albums
+        self.views = {}
+        for kind in KINDS:
+            selected = [album for album in albums if kind is None or album.kind == kind]
+            by_title = sorted(selected, key=lambda album: _sort_key(album.album))
+            by_artist = sorted(selected, key=lambda album: (_sort_key(album.artist), album.album.casefold()))
+            self.views[('title', kind)] = (by_title, [LETTERS.index(initial(a.album)) for a in by_title])
+            self.views[('artist', kind)] = (by_artist, [LETTERS.index(initial(a.artist)) for a in by_artist])
+
+    def view(self, order, kind):
+        return self.views[(order, kind)][0]
+
+    def letters(self, order, kind):
+        """index letters having at least one entry in the view."""
+        return {LETTERS[position] for position in self.views[(order, kind)][1]}
+
+    def position(self, order, kind, letter):
+        """position of the first entry at or after letter in the view."""
+        albums, positions = self.views[(order, kind)]
+        return min(bisect.bisect_left(positions, LETTERS.index(letter)), max(len(albums) - 1, 0))
+
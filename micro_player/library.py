@@ -0,0 +1,119 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+
+from .cache import LRUCache
+from .favorites import load_snapshot, save_snapshot
+from .lms import Album
+
+PLACEHOLDER = Album(album="loading...")
+
+
+class Library:
+    """Albums or artists of the LMS library, as a sequence loaded page by page.
+
+    Missing pages are fetched in background and read as PLACEHOLDER until
+    then. Pages are kept on disk, thumbnails included, under the time of the
+    last library scan so they stay valid until the next scan. Failed queries
+    raise: nothing is saved or removed on their account.
+    """
+
+    PAGE_SIZE = 50
+
+    def __init__(self, player, kind, directory, pages=8):
+        self.player = player
+        self.kind = kind  # library_album or library_artist
+        self.directory = directory
+        self.stamp = None
+        self.count = 0
+        self.pages = LRUCache(pages)
+        self.loading = {}  # page number -> fetch task
+        self.opening = None  # open task
+        self.version = 0  # changes when a page is loaded
+
+    def _path(self, name):
+        return os.path.join(self.directory, self.stamp, name)
+
+    def open_soon(self):
+        """open the library in background, the version changes once done."""
+        if self.opening is None or self.opening.done():
+            self.opening = asyncio.create_task(self._open())
+
+    async def _open(self):
+        try:
+            await self.open()
+        except Exception as e:
+            logging.error(f"Error while opening the {self.kind} library: {e}")
+        self.version += 1
+
+    async def open(self):
+        """check the library scan time, dropping the pages of an older scan."""
+        stamp = await self.player.get_library_stamp()
+        if stamp == self.stamp:
+            return
+        self.stamp = stamp
+        self.pages.clear()
+        os.makedirs(os.path.join(self.directory, stamp), exist_ok=True)
+        for entry in os.listdir(self.directory):
+            if entry != stamp:
+                shutil.rmtree(os.path.join(self.directory, entry), ignore_errors=True)
+        try:
+            with open(self._path(f"{self.kind}.json")) as f:
+                self.count = json.load(f)["count"]
+        except (OSError, ValueError, KeyError):
+            try:
+                await self._fetch(0)
+            except Exception:
+                # checked again at the next open
+                self.stamp = None
+                raise
+        logging.debug(f"{self.kind}: {self.count} items, scanned at {stamp}")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        number, offset = divmod(index, self.PAGE_SIZE)
+        page = self.pages.get(number)
+        if page is None:
+            if number not in self.loading:
+                self.loading[number] = asyncio.create_task(self._load(number))
+            return PLACEHOLDER
+        return page[offset] if offset < len(page) else PLACEHOLDER
+
+    def __contains__(self, album):
+        # only the loaded pages, the library is never walked whole
+        return any(album in page for page in self.pages.items.values())
+
+    async def _load(self, number):
+        try:
+            await self._fetch(number)
+        except Exception as e:
+            logging.error(f"Error while loading {self.kind} page {number}: {e}")
+        finally:
+            del self.loading[number]
+
+    async def _fetch(self, number):
+        path = self._path(f"{self.kind}-{number}.bin")
+        items = load_snapshot(path)
+        missing = []
+        if items is None:
+            items, self.count = await self.player.get_library_page(self.kind, number * self.PAGE_SIZE, self.PAGE_SIZE)
+            await self.player.fetch_artwork([item for item in items if item.icon])
+            save_snapshot(path, items)
+            with open(self._path(f"{self.kind}.json"), 'w') as f:
+                json.dump({"count": self.count}, f)
+        else:
+            # covers that failed to download are tried again each time the page is loaded
+            missing = [item for item in items if item.icon and item.artwork is None]
+        self.pages.put(number, items)
+        self.version += 1
+        if missing:
+            await self.player.fetch_artwork(missing)
+            if any(item.artwork for item in missing):
+                save_snapshot(path, items)
+                self.version += 1
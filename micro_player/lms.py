@@ -1,82 +1,207 @@
 import asyncio
-import io
 import logging
+import time
 import urllib.parse
+from time import monotonic as _monotonic
 
 import aiohttp
 from PIL import Image
-from pysqueezebox import Server
-from . import get_asset_path
+from pysqueezebox import Player as LMSPlayer, Server
+from .playqueue import PlayQueue
+from .artwork import (
+    CachedArtwork, artwork_cache, decode_artwork, fetch_metrics, proxied_artwork_url, run_in_pool,
+    sized_artwork_url,
+)
+from .metrics import COMMAND_BUCKETS, Histogram
 
 
 class Track:
-    def __init__(self, title="", artist="", album="", duration=None, artwork=None, time=0):
+    __slots__ = ("title", "artist", "album", "duration", "artwork", "time", "time_at")
+
+    def __init__(self, title="", artist="", album="", duration=None, artwork=None, time=0, time_at=None):
         self.title = title
         self.artist = artist
         self.album = album
         self.duration = duration
-        self.artwork = artwork
-        self.time = time
+        self.artwork = artwork  # packed 1-bit thumbnail, see artwork.pack_artwork
+        self.time = time  # seconds played when time_at, a monotonic clock reading, was taken
+        self.time_at = _monotonic() if time_at is None else time_at
+
+    def position(self, playing):
+        """seconds played, interpolated from the last known time while playing."""
+        position = (self.time or 0) + (_monotonic() - self.time_at if playing else 0)
+        return min(position, self.duration) if self.duration else position
+
+    def resync(self, playing, time=None):
+        """restart the interpolation from time, or from the current position."""
+        self.time = self.position(playing) if time is None else time
+        self.time_at = _monotonic()
 
 
 class Album:
-    def __init__(self, artist="", album="", artwork=None, url=""):
+    __slots__ = ("artist", "album", "artwork", "url", "icon", "kind")
+
+    def __init__(self, artist="", album="", artwork=None, url="", icon="", kind="album"):
         self.artist = artist
         self.album = album
-        self.artwork = artwork
+        self.artwork = artwork  # packed 1-bit thumbnail, see artwork.pack_artwork
         self.url = url
+        self.icon = icon  # artwork url
+        self.kind = kind  # album or playlist, library_album or library_artist
 
 
 class Player:
     MAX_RETRIES = 3  # Number of retries for network requests
     TIMEOUT = 5
+    EVENTS = "pause,stop,play,playlist,client,prefset,mixer,time"
+    IDLE_EVENTS = "pause,stop,play,playlist,mixer,time"  # playback status, seeks and the rare volume changes
+    MAX_RECONNECT_DELAY = 30
 
-    def __init__(self, server, player_name, user):
+    def __init__(self, server, player_name, user, trace=None):
         self.stop_subscribing = asyncio.Event()
+        self.trace = trace  # trace.TraceWriter recording the CLI events
         self.LMS = server
-        self.player_name = player_name
+        self.player_name = player_name  # active player
         self.user = user
         self.player_status = "pause"
-
+        self.volume = None  # of the active player, from its status and mixer events
+
+        # one connection pool and one CLI subscription shared by every player
+        self.session = None
+        self.directory = {}  # player name -> player id, kept up to date by client events
+        self.statuses = {}  # player id -> play or pause
+        self.directory_loaded = False
+
+        self.events_writer = None
+        self.events = self.EVENTS
+        self.reconnects = 0
+        self.command_latency = Histogram(COMMAND_BUCKETS)
+        self.track_changed = asyncio.Event()  # set on a new song of the active player
+        self.position_version = 0  # changes when the position of the current track is known anew
         self.subscribe_task = asyncio.create_task(self.subscribe_to_player_events())
         self.current_track = None
-
-    async def _get_player(self, session):
+        self.track_task = None
+        self.queue = PlayQueue(self)
+
+    def _get_session(self):
+        """Helper method returning the shared HTTP session."""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=4),
+                timeout=aiohttp.ClientTimeout(total=self.TIMEOUT * 2),
+            )
+        return self.session
+
+    async def _load_directory(self):
+        """Helper method listing the players once, events keep the directory up to date."""
+        players = await Server(self._get_session(), self.LMS).async_get_players() or []
+        self.directory = {player.name: player.player_id for player in players}
+        self.directory_loaded = True
+        logging.debug(f"players: {', '.join(self.directory)}")
+        if self.trace is not None and self.player_id:
+            self.trace.player(self.player_id, self.player_name)
+
+    async def _get_player(self, name=None):
         """Helper method to fetch the player object."""
-        lms = Server(session, self.LMS)
-        player = await lms.async_get_player(name=self.player_name)
-        if player is None:
-            raise ValueError(f"player {self.player_name} not found")
-        return player
-
-    async def _get_image(self, session, url):
-        """Helper method to fetch and return an image with retries.
-        If fetching fails, it loads a local fallback image.
+        name = name or self.player_name
+        if name not in self.directory and not self.directory_loaded:
+            await self._load_directory()
+        if name not in self.directory:
+            raise ValueError(f"player {name} not found")
+        return LMSPlayer(Server(self._get_session(), self.LMS), self.directory[name], name)
+
+    @property
+    def player_id(self):
+        return self.directory.get(self.player_name)
+
+    async def get_players(self):
+        """return the names of the known players."""
+        if not self.directory_loaded:
+            await self._load_directory()
+        return list(self.directory)
+
+    def set_active_player(self, name):
+        """switch the controlled player, using the cached directory and status."""
+        if name not in self.directory:
+            raise ValueError(f"player {name} not found")
+        logging.debug(f"active player: {name}")
+        self.player_name = name
+        if self.trace is not None:
+            self.trace.player(self.directory[name], name)
+        self.player_status = self.statuses.get(self.directory[name], "pause")
+        self.volume = None
+        self.current_track = None
+        self.queue.invalidate()
+        self.schedule_track_update()
+
+    async def close(self):
+        """stop the subscription and release the connection pool."""
+        self.stop_subscribing.set()
+        self.subscribe_task.cancel()
+        self.cancel_track_update()
+        if self.session is not None:
+            await self.session.close()
+
+    async def _get_image(self, url):
+        """Helper method to fetch an image with retries and return it as a packed thumbnail.
+        Cached images are revalidated with a conditional request once stale.
+        If fetching fails, it returns the stale cached image or None: the display
+        draws its fallback image and the next resync tries again.
         """
+        url = self._artwork_url(url)
+        cached = artwork_cache.get(url)
+        if cached is not None and cached.fresh:
+            return cached.artwork
+
         logging.debug(f"Trying to get image from URL: {url}")
+        headers = cached.conditional_headers() if cached is not None else {}
         for attempt in range(self.MAX_RETRIES):
             try:
-                async with session.get(url=url) as response:
+                begin = time.monotonic()
+                async with self._get_session().get(url=url, headers=headers) as response:
+                    if response.status == 304 and cached is not None:
+                        fetch_metrics['not_modified'] += 1
+                        cached.revalidated(response.headers)
+                        return cached.artwork
                     response.raise_for_status()  # Raise an error for bad responses
-                    buffer = io.BytesIO(await response.read())
-                    return Image.open(buffer)
+                    data = await response.read()
+                    response_headers = response.headers
+                elapsed = time.monotonic() - begin
+                fetch_metrics['fetches'] += 1
+                fetch_metrics['bytes'] += len(data)
+                fetch_metrics['seconds'] += elapsed
+                logging.debug(f"Fetched {len(data)} bytes in {elapsed * 1000:.0f} ms")
+
+                artwork = await run_in_pool(decode_artwork, data)
+                artwork_cache.put(url, CachedArtwork(artwork, response_headers))
+                return artwork
             except aiohttp.ClientError as e:
                 logging.warning(f"Attempt {attempt + 1} - Error fetching image: {e}")
                 if attempt == self.MAX_RETRIES - 1:
-                    logging.error("All attempts to fetch image failed, loading fallback image.")
-                    break  # Exit the retry loop to load the fallback image
+                    logging.error("All attempts to fetch image failed.")
+                    break
             except asyncio.TimeoutError:
                 logging.warning(f"Attempt {attempt + 1} - Timeout while fetching image.")
                 if attempt == self.MAX_RETRIES - 1:
-                    logging.error("All attempts to fetch image timed out, loading fallback image.")
-                    break  # Exit the retry loop to load the fallback image
-
-        # Load local fallback image
-        return Image.open(get_asset_path('fallback.png'))
+                    logging.error("All attempts to fetch image timed out.")
+                    break
+            except (OSError, Image.DecompressionBombError) as e:
+                logging.error(f"Unable to decode image: {e}")
+                break
+
+        return cached.artwork if cached is not None else None
+
+    @staticmethod
+    async def _query(player, *command):
+        """Helper method running a query, pysqueezebox returns None instead of raising when it fails."""
+        result = await player.async_query(*command)
+        if result is None:
+            raise ConnectionError(f"LMS query failed: {' '.join(command)}")
+        return result
 
     async def _get_spotify_item_id(self, player):
         """Helper method to get the Spotify user ID."""
-        results = await player.async_query("spotty", "items", "0", "255", "menu:spotty")
+        results = await self._query(player, "spotty", "items", "0", "255", "menu:spotty")
         for result in results["item_loop"]:
             if result["text"] == self.user:
                 return result["actions"]["go"]["params"]["item_id"]
@@ -87,9 +212,13 @@ class Player:
         lms = Server(None, self.LMS)
         return lms.generate_image_url(url)
 
-    async def get_spotify_favorite(self):
-        sync_album_task = asyncio.create_task(self.get_spotify_albums())
-        sync_playlists_task = asyncio.create_task(self.get_spotify_playlists())
+    def _artwork_url(self, url):
+        """Helper method asking the LMS image proxy for a cover pre-scaled to the thumbnail size."""
+        return sized_artwork_url(self._generate_image_url(proxied_artwork_url(url)))
+
+    async def get_spotify_favorite(self, with_artwork=True):
+        sync_album_task = asyncio.create_task(self.get_spotify_albums(with_artwork))
+        sync_playlists_task = asyncio.create_task(self.get_spotify_playlists(with_artwork))
 
         playlists = await sync_playlists_task
         albums = await sync_album_task
@@ -97,117 +226,274 @@ class Player:
         playlists.extend(albums)
         return playlists
 
-    async def get_spotify_playlists(self):
-        async with aiohttp.ClientSession() as session:
-            player = await self._get_player(session)
-            item_id = await self._get_spotify_item_id(player)
-
-            if not item_id:
-                return []
-
-            playlists = []
-            results = await player.async_query("spotty", "items", "0", "255", "menu:spotty", f"item_id:{item_id}.3")
-            for item in results["item_loop"]:
-                img = await self._get_image(session, item["presetParams"]["icon"])
-                playlists.append(
-                    Album(album=item["text"], artist=self.user, artwork=img, url=item["presetParams"]["favorites_url"])
-                )
-            return playlists
-
-    async def get_spotify_albums(self):
-        async with aiohttp.ClientSession() as session:
-            player = await self._get_player(session)
-            item_id = await self._get_spotify_item_id(player)
-            if not item_id:
-                return []
-
-            results = await player.async_query(
-                "spotty", "items", "0", "255", "menu:spotty", f"item_id:{item_id}.1"
+    async def fetch_artwork(self, albums):
+        """download the artwork of the given albums."""
+        for album in albums:
+            album.artwork = await self._get_image(album.icon)
+        if fetch_metrics['fetches']:
+            logging.debug(f"artwork: {fetch_metrics['fetches']} fetched, {fetch_metrics['not_modified']} not modified, "
+                          f"{fetch_metrics['bytes'] // 1024} KiB, "
+                          f"{fetch_metrics['seconds'] / fetch_metrics['fetches'] * 1000:.0f} ms per cover")
+
+    async def get_spotify_playlists(self, with_artwork=True):
+        player = await self._get_player()
+        item_id = await self._get_spotify_item_id(player)
+
+        if not item_id:
+            return []
+
+        playlists = []
+        results = await self._query(player, "spotty", "items", "0", "255", "menu:spotty", f"item_id:{item_id}.3")
+        for item in results["item_loop"]:
+            playlists.append(
+                Album(album=item["text"], artist=self.user, url=item["presetParams"]["favorites_url"],
+                      icon=item["presetParams"]["icon"], kind="playlist")
             )
+        if with_artwork:
+            await self.fetch_artwork(playlists)
+        return playlists
 
-            albums = []
-            for item in results["item_loop"]:
-                img = await self._get_image(session, item["presetParams"]["icon"])
-                txt = item["text"].split("\n")
-                albums.append(
-                    Album(album=txt[0], artist=txt[1], artwork=img, url=item["presetParams"]["favorites_url"])
-                )
-            return albums
+    async def get_spotify_albums(self, with_artwork=True):
+        player = await self._get_player()
+        item_id = await self._get_spotify_item_id(player)
+        if not item_id:
+            return []
+
+        results = await self._query(
+            player, "spotty", "items", "0", "255", "menu:spotty", f"item_id:{item_id}.1"
+        )
+
+        albums = []
+        for item in results["item_loop"]:
+            txt = item["text"].split("\n")
+            albums.append(
+                Album(album=txt[0], artist=txt[1], url=item["presetParams"]["favorites_url"],
+                      icon=item["presetParams"]["icon"], kind="album")
+            )
+        if with_artwork:
+            await self.fetch_artwork(albums)
+        return albums
 
     async def pause(self):
-        async with aiohttp.ClientSession() as session:
-            player = await self._get_player(session)
+        with self.command_latency.time():
+            player = await self._get_player()
             await player.async_pause()
 
+    async def get_library_stamp(self):
+        """time of the last library scan, it changes whenever the library does."""
+        result = await self._query(Server(self._get_session(), self.LMS), "serverstatus", "0", "0")
+        return str(result.get("lastscan", 0))
+
+    async def get_library_page(self, kind, start, count):
+        """count library albums or artists from start, and the size of the library.
+
+        Only the tags drawn on an album card are requested.
+        """
+        player = await self._get_player()
+        if kind == "library_artist":
+            result = await self._query(player, "artists", str(start), str(count))
+            items = [
+                Album(album=item["artist"], url=f"artist_id:{item['id']}", kind=kind)
+                for item in result.get("artists_loop", [])
+            ]
+        else:
+            result = await self._query(player, "albums", str(start), str(count), "tags:laj")
+            items = [
+                Album(album=item.get("album", ""), artist=item.get("artist", ""), url=f"album_id:{item['id']}",
+                      icon=f"/music/{item['artwork_track_id']}/cover.jpg" if "artwork_track_id" in item else "",
+                      kind=kind)
+                for item in result.get("albums_loop", [])
+            ]
+        return items, int(result.get("count", 0))
+
     async def play_url(self, url):
-        async with aiohttp.ClientSession() as session:
-            player = await self._get_player(session)
-            await player.async_load_url(url)
+        with self.command_latency.time():
+            player = await self._get_player()
+            if url.startswith(("album_id:", "artist_id:")):
+                # library items are loaded by database id
+                await player.async_query("playlistcontrol", "cmd:load", url)
+            else:
+                await player.async_load_url(url)
 
     async def play(self):
-        async with aiohttp.ClientSession() as session:
-            player = await self._get_player(session)
+        with self.command_latency.time():
+            player = await self._get_player()
             await player.async_play()
 
-    async def next(self):
-        async with aiohttp.ClientSession() as session:
-            player = await self._get_player(session)
-            await player.async_query("playlist", "index", "+1")
+    async def skip(self, offset):
+        """move by offset tracks in the playlist with a single command.
 
-    async def previous(self):
-        async with aiohttp.ClientSession() as session:
-            player = await self._get_player(session)
-            await player.async_query("button", "jump_rew")
+        A single tap back now skips to the previous track as well, it no
+        longer restarts the current one as the 'button jump_rew' it replaces.
+        """
+        if offset:
+            with self.command_latency.time():
+                player = await self._get_player()
+                await player.async_query("playlist", "index", f"{offset:+d}")
+
+    async def set_volume(self, volume):
+        """set the volume, 0 to 100."""
+        with self.command_latency.time():
+            player = await self._get_player()
+            await player.async_query("mixer", "volume", str(volume))
+        self.volume = volume
+
+    async def get_playlist_page(self, start, count):
+        """(index, title, artist) of count playlist tracks from start, the playing index and the playlist length."""
+        player = await self._get_player()
+        result = await player.async_query("status", str(start), str(count), "tags:a") or {}
+        tracks = [
+            (int(item["playlist index"]), item.get("title", ""), item.get("artist", ""))
+            for item in result.get("playlist_loop", [])
+        ]
+        return tracks, int(result.get("playlist_cur_index", 0)), int(result.get("playlist_tracks", 0))
 
     async def update_current_track(self):
-        async with aiohttp.ClientSession() as session:
-            player = await self._get_player(session)
-            await player.async_update()
-
-            if not player.current_track:
-                return None
-
-            img_url = self._generate_image_url(player.current_track["artwork_url"])  # Generate the image URL
-
-            artist = ""
-            if "artist" in player.current_track:
-                artist = player.current_track["artist"]
-
-            album = ""
-            if "album" in player.current_track:
-                album = player.current_track["album"]
-
-            self.current_track = Track(
-                title=player.current_track["title"],
-                artist=artist,
-                album=album,
-                duration=player.duration_float,
-                artwork=await self._get_image(session, img_url),
-                time=player.time
-            )
+        player = await self._get_player()
+        await player.async_update()
+        if player.volume is not None:
+            self.volume = int(player.volume)
+
+        if not player.current_track:
+            return None
+
+        if "artwork_url" in player.current_track:
+            img_url = player.current_track["artwork_url"]
+        else:
+            img_url = f"/music/{player.current_track.get('coverid', 'unknown')}/cover.jpg"
+
+        artist = ""
+        if "artist" in player.current_track:
+            artist = player.current_track["artist"]
+
+        album = ""
+        if "album" in player.current_track:
+            album = player.current_track["album"]
+
+        self.current_track = Track(
+            title=player.current_track["title"],
+            artist=artist,
+            album=album,
+            duration=player.duration_float,
+            artwork=await self._get_image(img_url),
+            time=player.time
+        )
+        self.position_version += 1
+
+    def schedule_track_update(self):
+        """update the current track in background, superseding a pending update."""
+        self.cancel_track_update()
+        self.track_task = asyncio.create_task(self._update_current_track_in_background())
+
+    def cancel_track_update(self):
+        """cancel a pending track update, e.g. when leaving the player screen."""
+        if self.track_task is not None and not self.track_task.done():
+            self.track_task.cancel()
+        self.track_task = None
+
+    async def _update_current_track_in_background(self):
+        try:
+            await self.update_current_track()
+        except asyncio.CancelledError:
+            logging.debug("track update cancelled")
+            raise
+        except Exception as e:
+            logging.error(f"Error while updating current track: {e}")
 
     async def subscribe_to_player_events(self):
-        """Subscribe to player events for the given player_id."""
-        async with aiohttp.ClientSession() as session:
-            player = await self._get_player(session)
-
-            reader, writer = await asyncio.open_connection(self.LMS, 9090)
-            writer.write(f"{player.player_id} subscribe pause,stop,play,playlist newsong\n".encode())
+        """Subscribe to the events of every player, reconnecting with backoff when the connection drops."""
+        delay = 1
+        while not self.stop_subscribing.is_set():
+            try:
+                await self._read_player_events()
+                delay = 1
+            except OSError as e:
+                logging.warning(f"LMS event connection failed: {e}")
+            if self.stop_subscribing.is_set():
+                break
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY)
+            self.reconnects += 1
+
+    async def _read_player_events(self):
+        """Subscribe to the events of every player on a single CLI connection."""
+        reader, writer = await asyncio.open_connection(self.LMS, 9090)
+        try:
+            writer.write(f"subscribe {self.events}\n".encode())
             await writer.drain()
+            self.events_writer = writer
 
-            logging.debug(f"Subscribed to player {player.player_id} events.")
+            logging.debug("Subscribed to players events.")
+            if self.reconnects:
+                # events were missed while disconnected
+                self.directory_loaded = False
+                self.queue.invalidate()
+                self.schedule_track_update()
 
             # Continuously read event messages
             while not self.stop_subscribing.is_set():
                 response = await reader.readline()
+                if not response:
+                    logging.warning("LMS closed the event connection")
+                    break
+                if self.trace is not None:
+                    self.trace.event(response)
                 event = urllib.parse.unquote(response.decode().strip())
                 await self.handle_event(event)
-
-        if writer:
+        finally:
+            self.events_writer = None
             writer.close()
             await writer.wait_closed()
             logging.debug("Connection closed")
 
+    async def set_idle(self, idle):
+        """reduce the subscription to playback status while idle."""
+        self.events = self.IDLE_EVENTS if idle else self.EVENTS
+        if self.events_writer is None:
+            return
+        self.events_writer.write(f"subscribe {self.events}\n".encode())
+        await self.events_writer.drain()
+        if not idle:
+            # players may have come and gone unnoticed
+            self.directory_loaded = False
+
+    def _set_status(self, player_id, status):
+        self.statuses[player_id] = status
+        if player_id == self.player_id:
+            if self.current_track is not None and status != self.player_status:
+                # the position stops or starts moving now
+                self.current_track.resync(self.player_status == "play")
+                self.position_version += 1
+            self.player_status = status
+
+    def _handle_time_event(self, value):
+        """seek of the active player: time <seconds>, signed when relative."""
+        track = self.current_track
+        if track is None:
+            return
+        try:
+            seconds = float(value)
+        except ValueError:
+            return
+        playing = self.player_status == "play"
+        if value[0] in '+-':
+            seconds += track.position(playing)
+        track.resync(playing, max(seconds, 0))
+        self.position_version += 1
+
+    async def _handle_client_event(self, player_id, parts):
+        """keep the player directory up to date without listing every player."""
+        if 'new' in parts or 'reconnect' in parts:
+            player = await Server(self._get_session(), self.LMS).async_get_player(player_id=player_id)
+            if player is not None:
+                self.directory[player.name] = player_id
+                logging.debug(f"Player {player.name} connected.")
+        elif 'forget' in parts:
+            for name, known_id in list(self.directory.items()):
+                if known_id == player_id:
+                    del self.directory[name]
+            self.statuses.pop(player_id, None)
+
     async def handle_event(self, event_response):
         """Handle LMS player events by parsing the event response."""
         logging.debug(f"Received event: {event_response}")
@@ -224,27 +510,57 @@ class Player:
 
         # Handle different event types
         if command == 'playlist':
+            if player_id == self.player_id:
+                self.queue.handle_event(parts)
             if 'newsong' in parts:
-                await self.update_current_track()
-                self.player_status = 'play'
+                if player_id == self.player_id:
+                    self.track_changed.set()
+                    self.schedule_track_update()
+                self._set_status(player_id, 'play')
             elif 'stop' in parts:
                 logging.debug(f"Player {player_id} paused.")
-                self.player_status = 'pause'
-            elif command == 'pause':
+                self._set_status(player_id, 'pause')
+            elif 'pause' in parts:
                 # Handle pause event
                 if '1' in parts:
                     logging.debug(f"Player {player_id} paused.")
-                    self.player_status = 'pause'
+                    self._set_status(player_id, 'pause')
                 elif '0' in parts:
                     logging.debug(f"Player {player_id} resumed playing.")
-                    # Add logic here for resuming from pause
-                    self.player_status = 'play'
+                    self._set_status(player_id, 'play')
 
         elif command == 'play':
             # Handle play event
             logging.debug(f"Player {player_id} started playing.")
-            self.player_status = 'play'
+            self._set_status(player_id, 'play')
 
         elif command == 'pause':
             logging.debug(f"Player {player_id} paused.")
-            self.player_status = 'pause'
+            self._set_status(player_id, 'pause')
+
+        elif command == 'mixer' and len(parts) > 3 and parts[2] == 'volume':
+            if player_id == self.player_id:
+                # relative changes come signed, from other controllers
+                value = parts[3]
+                try:
+                    volume = round((self.volume or 0) + float(value) if value[0] in '+-' else float(value))
+                except ValueError:
+                    return
+                self.volume = min(max(volume, 0), 100)
+
+        elif command == 'time' and len(parts) > 2:
+            if player_id == self.player_id:
+                self._handle_time_event(parts[2])
+
+        elif command == 'client':
+            await self._handle_client_event(player_id, parts)
+
+        elif command == 'prefset' and 'playername' in parts:
+            # renamed player: prefset server playername <name>
+            name = " ".join(parts[parts.index('playername') + 1:])
+            for old_name, known_id in list(self.directory.items()):
+                if known_id == player_id:
+                    del self.directory[old_name]
+                    if old_name == self.player_name:
+                        self.player_name = name
+            self.directory[name] = player_id
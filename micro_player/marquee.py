@@ -0,0 +1,88 @@
+import logging
+import time
+
+
+class Marquee:
+    """Scroll the player screen lines too long for the panel.
+
+    Each step moves the overflowing lines by `step` pixels, cut from their
+    pre-rendered text strips, and sends only the band holding them. Steps
+    start once the panel is free, leave it free for the rest of `duty`, and
+    slow down as the ghosting budget is spent, so touches are never kept
+    waiting behind the scrolling. Lines pause at both ends.
+    """
+
+    PAUSE = 1.0  # seconds at the start and at the end of a line
+
+    def __init__(self, display, step=16, duty=0.5):
+        self.display = display
+        self.step_size = step
+        self.duty = duty
+        self.lines = []  # ((x, y), text, width shown, last offset) of the overflowing lines
+        self.offset = 0
+        self.next_at = 0.0
+        self.metrics = {'steps': 0}
+
+    def start(self, lines):
+        """scroll the ((x, y), text) lines drawn from their start, when they overflow."""
+        self.lines = []
+        for (x, y), text in lines:
+            width = self.display.canvas.width - x
+            overflow = self.display.text_strip(text).width - width
+            if overflow > 0:
+                self.lines.append(((x, y), text, width, overflow))
+        self.offset = 0
+        self.next_at = time.monotonic() + self.pause
+
+    @property
+    def pause(self):
+        """pause at the line ends, well within the presenter sleep delay so the panel stays awake."""
+        return min(self.PAUSE, self.display.sleep_delay / 2)
+
+    def stop(self):
+        self.lines = []
+        self.offset = 0
+
+    @property
+    def interval(self):
+        """seconds between steps: the measured partial waveform over the duty, longer once ghosting builds up."""
+        ghosting = self.display.refresh_policy.ghosting
+        return self.display.partial_seconds / self.duty / max(1 - ghosting, 0.25)
+
+    def step(self):
+        """move the lines once when due and the panel is free, returns whether a frame was queued."""
+        display = self.display
+        now = time.monotonic()
+        if not self.lines or now < self.next_at or display.pending is not None or display.epd.busy:
+            return False
+        if display.refresh_policy.ghosting >= 1:
+            # the due full refresh comes first
+            return False
+        end = max(overflow for _, _, _, overflow in self.lines)
+        if self.offset >= end:
+            self.offset = 0
+            self.next_at = now + self.pause
+        else:
+            self.offset = min(self.offset + self.step_size, end)
+            self.next_at = now + (self.pause if self.offset == end else self.interval)
+        self._draw()
+        self.metrics['steps'] += 1
+        return True
+
+    def rest(self):
+        """put the lines back to their start, e.g. before idling."""
+        if self.offset:
+            self.offset = 0
+            self._draw()
+
+    def _draw(self):
+        display = self.display
+        x0 = y0 = display.canvas.width
+        y1 = 0
+        for (x, y), text, width, overflow in self.lines:
+            height = display.text_strip(text).height
+            display.canvas.paste(255, (x, y, x + width, y + height))
+            display.draw_text((x, y), text, max_width=width, offset=min(self.offset, overflow))
+            x0, y0, y1 = min(x0, x), min(y0, y), max(y1, y + height)
+        logging.debug(f"marquee at {self.offset}px, every {self.interval:.2f}s")
+        display.region_refresh((x0, y0, display.canvas.width, y1))
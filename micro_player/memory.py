@@ -0,0 +1,66 @@
+import asyncio
+import logging
+import signal
+import sys
+import tracemalloc
+
+from PIL import Image
+
+MIB = 1024 * 1024
+
+
+def footprint(value):
+    """approximate bytes held by a cached value: packed bytes, PIL images, tuples and slotted objects."""
+    if isinstance(value, Image.Image):
+        # PIL keeps '1' images one byte per pixel
+        bits = {'1': 8, 'L': 8, 'P': 8}.get(value.mode, 32)
+        return sys.getsizeof(value) + value.width * value.height * bits // 8
+    if isinstance(value, (tuple, list)):
+        return sys.getsizeof(value) + sum(footprint(item) for item in value)
+    if hasattr(type(value), '__slots__'):
+        return sys.getsizeof(value) + sum(footprint(getattr(value, name)) for name in type(value).__slots__)
+    return sys.getsizeof(value)
+
+
+class MemoryBudget:
+    """One memory ceiling shared by the caches, each bounded to its share by eviction."""
+
+    SHARES = {
+        'artwork': 0.5,  # dithered covers by url
+        'render': 0.3,  # pre-rendered album cards
+        'text': 0.2,  # rendered text strips
+    }
+
+    def __init__(self, total):
+        self.total = total
+        self.caches = {}
+
+    def register(self, name, cache):
+        """bound cache to the share of the budget named name."""
+        cache.limit(int(self.total * self.SHARES[name]), footprint)
+        self.caches[name] = cache
+
+    def report(self, limit=10):
+        """log cache usage and, when tracemalloc runs, the top allocating lines."""
+        for name, cache in self.caches.items():
+            logging.info(f"{name} cache: {cache.bytes // 1024}/{cache.maxbytes // 1024} KiB, "
+                         f"{len(cache)} entries, {cache.evictions} evictions")
+        if not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        logging.info(f"traced memory: {current // 1024} KiB, peak {peak // 1024} KiB")
+        snapshot = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        for stat in snapshot.statistics('lineno')[:limit]:
+            logging.info(f"  {stat}")
+
+    def install(self, interval=0):
+        """report on SIGUSR1, and every interval seconds when set. Returns the timer task, if any."""
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.report)
+        if interval > 0:
+            return asyncio.create_task(self._report_every(interval))
+        return None
+
+    async def _report_every(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.report()
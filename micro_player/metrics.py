@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+
+# upper bounds in seconds
+COMMAND_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+LAG_BUCKETS = (0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+class Histogram:
+    """Prometheus style histogram: cumulative bucket counts, sum and count."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+    @contextmanager
+    def time(self):
+        """observe the duration of the wrapped block."""
+        begin = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - begin)
+
+
+async def watch_loop_lag(histogram, interval=1.0, awake=None):
+    """observe how late the event loop wakes a sleeping task, pausing while awake is cleared."""
+    while True:
+        if awake is not None:
+            await awake.wait()
+        begin = time.monotonic()
+        await asyncio.sleep(interval)
+        histogram.observe(max(time.monotonic() - begin - interval, 0.0))
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels.items()) + "}"
+
+
+class MetricsServer:
+    """Small HTTP server exposing metrics in the Prometheus text format on /metrics and a /health route.
+
+    Metrics are read from their sources, the metrics dicts of the other
+    modules, when scraped.
+    """
+
+    def __init__(self):
+        self.metrics = {}  # name -> (type, help, [(labels, source)])
+        self.checks = {}  # name -> callable returning True when healthy
+        self.started = time.monotonic()
+        self.runner = None
+
+    def _add(self, kind, name, help, source, labels):
+        self.metrics.setdefault(name, (kind, help, []))[2].append((labels, source))
+
+    def counter(self, name, help, source, **labels):
+        """source is a callable returning the current total."""
+        self._add('counter', name, help, source, labels)
+
+    def gauge(self, name, help, source, **labels):
+        self._add('gauge', name, help, source, labels)
+
+    def histogram(self, name, help, histogram, **labels):
+        self._add('histogram', name, help, histogram, labels)
+
+    def check(self, name, source):
+        """add a health check, source returns True when healthy."""
+        self.checks[name] = source
+
+    def render(self):
+        lines = []
+        for name, (kind, help, series) in self.metrics.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, source in series:
+                if kind != 'histogram':
+                    lines.append(f"{name}{_labels(labels)} {source()}")
+                    continue
+                for bound, count in zip(source.buckets, source.counts):
+                    lines.append(f"{name}_bucket{_labels({**labels, 'le': bound})} {count}")
+                lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {source.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {source.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {source.count}")
+        return "\n".join(lines) + "\n"
+
+    def health(self):
+        checks = {name: bool(source()) for name, source in self.checks.items()}
+        return {
+            'status': 'ok' if all(checks.values()) else 'degraded',
+            'uptime': round(time.monotonic() - self.started),
+            'checks': checks,
+        }
+
+    async def start(self, host, port):
+        from aiohttp import web
+
+        async def metrics(request):
+            return web.Response(text=self.render(), content_type='text/plain', charset='utf-8')
+
+        async def health(request):
+            result = self.health()
+            return web.json_response(result, status=200 if result['status'] == 'ok' else 503)
+
+        app = web.Application()
+        app.router.add_get('/metrics', metrics)
+        app.router.add_get('/health', health)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+        logging.info(f"metrics on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
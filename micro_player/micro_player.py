@@ -1,35 +1,183 @@
 import asyncio
 import logging
+import time
 import traceback
 
 from . import config
-from .lms import Player
-from .display import EinkDisplay
+from .splash import show_splash
+from .spi import load_spi_settings
+from .timing import StartupTimer
 
 
-async def main():
+async def main(player_factory=None):
     eink_display = None
+    lms_player = None
+    trace = None
+    memory_report_task = None
+    metrics_server = None
+    lag_task = None
     try:
+        if config.MEMORY_TRACE_FRAMES:
+            import tracemalloc
+            tracemalloc.start(config.MEMORY_TRACE_FRAMES)
+        timer = StartupTimer()
+        with timer.phase("splash"):
+            from lib.epd2in13_V4_async import AsyncEPD
+            load_spi_settings()
+            epd = AsyncEPD()
+            splash = await show_splash(epd)
 
-        lms_player = Player(config.LMS_SERVER, config.PLAYER_NAME, config.SPOTIFY_USER)
-        sync_album_task = asyncio.create_task(lms_player.get_spotify_favorite())
-        spotify_albums_index = 0
+        # heavy modules (aiohttp, pysqueezebox, PIL) are imported once the splash is up
+        with timer.phase("imports"):
+            from .lms import Player
+            from .display import EinkDisplay
+            from .favorites import favorites_footprint, load_snapshot, revalidate_favorites, save_snapshot
+            from .prefetch import AlbumPrefetcher
+            from .commands import CommandScheduler
+            from .refresh import RefreshPolicy
+            from .index import FavoritesIndex, KINDS, LIBRARY_KINDS, ORDERS
+            from .library import Library, PLACEHOLDER
+            from .artwork import artwork_cache, fetch_metrics
+            from .memory import MIB, MemoryBudget
+            from .idle import IdleMonitor
+            from .marquee import Marquee
+
+        with timer.phase("lms"):
+            if config.TRACE_FILE:
+                from .trace import TraceWriter
+                trace = TraceWriter(config.TRACE_FILE)
+            lms_player = (player_factory or Player)(config.LMS_SERVER, config.PLAYER_NAME, config.SPOTIFY_USER, trace)
+            scheduler = CommandScheduler(lms_player, config.COMMAND_DEBOUNCE, config.VOLUME_INTERVAL)
+
+        with timer.phase("favorites"):
+            # the snapshot is browsable right away, the live menus are diffed in background
+            spotify_albums = load_snapshot(config.FAVORITES_FILE) or []
+            sync_album_task = asyncio.create_task(revalidate_favorites(lms_player, spotify_albums))
+            next_sync = None
+            favorites_index = FavoritesIndex(spotify_albums)
+            # the selector browses favorites in their order until a letter is picked
+            selector_view = spotify_albums
+            spotify_albums_index = 0
+            jump_order, jump_kind, sorted_view = ORDERS[0], KINDS[0], False
+            # LMS library browsed instead of the favorites, by kind, and the page version shown
+            library, libraries, library_shown = None, {}, None
+
+        with timer.phase("display"):
+            refresh_policy = RefreshPolicy(
+                config.PARTIAL_UPDATE_COUNT,
+                config.GHOSTING_BUDGET * epd.width * epd.height,
+                config.FULL_REFRESH_TIME * 3600,
+                config.FULL_REFRESH_IDLE,
+            )
+            eink_display = EinkDisplay(refresh_policy, epd, splash, trace=trace)
+            if config.MARQUEE_STEP:
+                eink_display.marquee = Marquee(eink_display, config.MARQUEE_STEP, config.MARQUEE_DUTY)
+            prefetcher = AlbumPrefetcher(eink_display, config.PREFETCH_DEPTH)
+            memory_budget = MemoryBudget(config.MEMORY_BUDGET * MIB)
+            memory_budget.register('artwork', artwork_cache)
+            memory_budget.register('render', prefetcher.frames)
+            memory_budget.register('text', eink_display.texts)
+            memory_report_task = memory_budget.install(config.MEMORY_REPORT_INTERVAL)
+            idle_monitor = IdleMonitor(config.IDLE_TIMEOUT)
+
+        if config.METRICS_PORT:
+            from .metrics import LAG_BUCKETS, Histogram, MetricsServer, watch_loop_lag
+            metrics_server = MetricsServer()
+            for kind in ('full', 'partial', 'region', 'skipped'):
+                metrics_server.counter('micro_player_refreshes_total', "Panel refreshes by kind",
+                                       lambda kind=kind: refresh_policy.metrics[f'{kind}_refreshes'], kind=kind)
+            metrics_server.counter('micro_player_deferred_full_refreshes_total', "Full refreshes postponed by touches",
+                                   lambda: refresh_policy.metrics['deferred_full_refreshes'])
+            metrics_server.counter('micro_player_changed_pixels_total', "Pixels changed by partial refreshes",
+                                   lambda: refresh_policy.metrics['changed_pixels'])
+            if eink_display.marquee is not None:
+                metrics_server.counter('micro_player_marquee_steps_total', "Scrolling steps of long track lines",
+                                       lambda: eink_display.marquee.metrics['steps'])
+            metrics_server.gauge('micro_player_partial_refresh_seconds', "Average partial waveform duration",
+                                 lambda: eink_display.partial_seconds)
+            metrics_server.counter('micro_player_spi_bytes_total', "Bytes sent to the panel",
+                                   lambda: epd.metrics['spi_bytes'])
+            metrics_server.counter('micro_player_busy_wait_seconds_total', "Time spent waiting for the panel BUSY pin",
+                                   lambda: epd.metrics['busy_seconds'])
+            metrics_server.counter('micro_player_busy_waits_total', "Waits for the panel BUSY pin",
+                                   lambda: epd.metrics['busy_waits'])
+            metrics_server.histogram('micro_player_command_seconds', "Latency of LMS playback commands",
+                                     lms_player.command_latency)
+            metrics_server.counter('micro_player_reconnects_total', "LMS event subscription reconnections",
+                                   lambda: lms_player.reconnects)
+            for name, cache in memory_budget.caches.items():
+                metrics_server.counter('micro_player_cache_hits_total', "Cache hits", lambda c=cache: c.hits, cache=name)
+                metrics_server.counter('micro_player_cache_misses_total', "Cache misses",
+                                       lambda c=cache: c.misses, cache=name)
+                metrics_server.counter('micro_player_cache_evictions_total', "Cache evictions",
+                                       lambda c=cache: c.evictions, cache=name)
+                metrics_server.gauge('micro_player_cache_bytes', "Cache size", lambda c=cache: c.bytes, cache=name)
+            for name in ('fetches', 'not_modified', 'bytes', 'seconds'):
+                metrics_server.counter(f'micro_player_artwork_{name}_total', f"Artwork downloads: {name}",
+                                       lambda name=name: fetch_metrics[name])
+            for name in ('idle_seconds', 'idle_cpu_seconds'):
+                metrics_server.counter(f'micro_player_{name}_total', f"Idle mode: {name}",
+                                       lambda name=name: idle_monitor.metrics[name])
+            metrics_server.gauge('micro_player_wake_latency_seconds', "Last delay from wake up to the first frame",
+                                 lambda: idle_monitor.metrics['wake_latency_last'])
+            loop_lag = Histogram(LAG_BUCKETS)
+            metrics_server.histogram('micro_player_loop_lag_seconds', "Event loop scheduling delay", loop_lag)
+            # sampling pauses while idle, it would otherwise wake the loop every second
+            lag_task = asyncio.create_task(watch_loop_lag(loop_lag, awake=idle_monitor.awake))
+            metrics_server.check('lms_events', lambda: lms_player.events_writer is not None)
+            metrics_server.check('presenter', lambda: not eink_display.present_task.done())
+            metrics_server.check('touch', lambda: not eink_display.touch_task.done())
+            await metrics_server.start(config.METRICS_HOST, config.METRICS_PORT)
+
+        with timer.phase("first frame"):
+            eink_display.show_menu(lms_player.player_name)
+        timer.report()
+
+        def selected_album():
+            """album under the selector, a placeholder while a library opens."""
+            if spotify_albums_index < len(selector_view):
+                return selector_view[spotify_albums_index]
+            return PLACEHOLDER
+
+        def show_selected_album():
+            album = selected_album()
+            eink_display.show_album(album.album, album.artist, album.artwork, prefetcher.get(album))
+
+        def track_progress():
+            """played fraction of the current track, None when its duration is unknown."""
+            track = lms_player.current_track
+            if track is None or not track.duration:
+                return None
+            return track.position(lms_player.player_status == "play") / track.duration
+
+        def idle_timeout():
+            """seconds idling may last: until a full refresh is due or, while playing, the progress bar moves a pixel."""
+            timeout = eink_display.refresh_policy.full_refresh_in()
+            track = lms_player.current_track
+            if (config.PROGRESS_INTERVAL and eink_display.is_on_player_screen() and track is not None
+                    and track.duration and lms_player.player_status == "play"):
+                x0, _, x1, _ = eink_display.PROGRESS_BOX
+                timeout = min(timeout, max(config.PROGRESS_INTERVAL, track.duration / (x1 - x0)))
+            return timeout
 
-        eink_display = EinkDisplay(config.FULL_REFRESH_TIME, config.PARTIAL_UPDATE_COUNT)
         current_track = lms_player.current_track
-        spotify_albums = await sync_album_task
         is_playing = False
+        # progress bar: position version and time of the last redraw
+        progress_version, progress_at = None, 0.0
+        # play queue screen: first row offset from the playing track, pending fetch and version shown
+        queue_offset, queue_task, queue_shown = -1, None, None
         while True:
             try:
 
-                eink_display.refresh_if_needed()
-
                 # update current track if on player screen
                 if eink_display.is_on_player_screen():
                     if lms_player.current_track is not None:
-                        if current_track is None or current_track.title != lms_player.current_track.title:
+                        if current_track is not lms_player.current_track:
                             logging.debug("update track information...")
+                            idle_monitor.activity()
                             current_track = lms_player.current_track
+                            if config.PROGRESS_INTERVAL:
+                                eink_display.progress = track_progress()
                             eink_display.update_current_track(
                                 current_track.title,
                                 current_track.album,
@@ -44,86 +192,201 @@ async def main():
                         eink_display.show_play_pause(False)
                         is_playing = False
 
+                    # volume changed elsewhere, the slider shows its own moves until they are sent
+                    if (lms_player.volume is not None and lms_player.volume != eink_display.volume
+                            and not scheduler.volume_pending):
+                        eink_display.show_volume(lms_player.volume)
+
+                    # the progress bar moves by itself, play, pause and seek events resync it at once
+                    if config.PROGRESS_INTERVAL and current_track is not None and (
+                            progress_version != lms_player.position_version
+                            or time.monotonic() - progress_at >= config.PROGRESS_INTERVAL):
+                        progress = track_progress()
+                        if progress is not None:
+                            eink_display.show_progress(progress)
+                        progress_version, progress_at = lms_player.position_version, time.monotonic()
+
+                # show the play queue once fetched, fetch it again when the playlist changed
+                if queue_task is not None and queue_task.done():
+                    task, queue_task = queue_task, None
+                    tracks = task.result()
+                    if eink_display.screen in (2, 4):
+                        if tracks:
+                            queue_offset = tracks[0][0] - lms_player.queue.current
+                        eink_display.show_queue(tracks, lms_player.queue.current)
+                        queue_shown = lms_player.queue.version
+                elif eink_display.screen == 4 and queue_task is None and queue_shown != lms_player.queue.version:
+                    queue_task = asyncio.create_task(lms_player.queue.window(queue_offset, eink_display.QUEUE_ROWS))
+
                 # Reading touch events and managing interactions.
                 touch_event = eink_display.read_touch()
+                # after the touch is read, a due full refresh waits for the burst it starts
+                eink_display.refresh_if_needed()
+                if sync_album_task is None and time.monotonic() >= next_sync:
+                    # periodic differential resync, applied like the startup one
+                    sync_album_task = asyncio.create_task(revalidate_favorites(lms_player, spotify_albums))
+                elif sync_album_task is not None and sync_album_task.done():
+                    task, sync_album_task = sync_album_task, None
+                    try:
+                        synced_albums = task.result()
+                    except Exception as e:
+                        # e.g. an undecodable cover, the next resync tries again
+                        logging.error(f"Error while synchronizing favorites: {e}")
+                        synced_albums = None
+                    # without any favorite yet, e.g. Spotty still starting, try again soon
+                    next_sync = time.monotonic() + (
+                        config.FAVORITES_RESYNC_INTERVAL if synced_albums or spotify_albums else 30)
+                    if synced_albums is not None:
+                        spotify_albums = synced_albums
+                        save_snapshot(config.FAVORITES_FILE, spotify_albums)
+                        favorites_index = FavoritesIndex(spotify_albums)
+                    if synced_albums is not None and library is None:
+                        current = selector_view[spotify_albums_index] if selector_view else None
+                        selector_view = favorites_index.view(jump_order, jump_kind) if sorted_view else spotify_albums
+                        if current in selector_view:
+                            spotify_albums_index = selector_view.index(current)
+                        else:
+                            spotify_albums_index = min(spotify_albums_index, max(len(selector_view) - 1, 0))
+                    logging.debug(f"{len(spotify_albums)} favorites synchronized "
+                                  f"({favorites_footprint(spotify_albums) // 1024} KiB)")
+
                 if touch_event:
-                    if touch_event == 'selector':
+                    idle_monitor.activity()
+
+                    if touch_event == 'selector' and not selector_view:
+                        logging.info("favorites are not loaded yet")
+
+                    elif touch_event == 'selector':
                         logging.debug("selector icon touched...")
+                        scheduler.cancel()
+                        lms_player.cancel_track_update()
                         eink_display.show_selector()
-                        eink_display.show_album(
-                            spotify_albums[spotify_albums_index].album,
-                            spotify_albums[spotify_albums_index].artist,
-                            spotify_albums[spotify_albums_index].artwork,
-                        )
+                        show_selected_album()
                         await lms_player.pause()
 
                     elif touch_event == 'player':
                         logging.debug("Player icon touched...")
                         eink_display.show_player()
                         await lms_player.update_current_track()
+                        current_track = lms_player.current_track
                         eink_display.update_current_track(lms_player.current_track.title,
                                                           lms_player.current_track.album,
                                                           lms_player.current_track.artist,
                                                           lms_player.current_track.artwork)
                         await lms_player.play()
 
+                    elif touch_event == 'launch_player' and not selected_album().url:
+                        logging.info("library page is not loaded yet")
+
                     elif touch_event == 'launch_player':
                         logging.debug("player icon from menu touched...")
                         eink_display.show_player()
-                        await lms_player.play_url(spotify_albums[spotify_albums_index].url)
+                        await lms_player.play_url(selected_album().url)
                         await lms_player.update_current_track()
+                        current_track = lms_player.current_track
                         eink_display.update_current_track(lms_player.current_track.title,
                                                           lms_player.current_track.album,
                                                           lms_player.current_track.artist,
                                                           lms_player.current_track.artwork)
 
+                    elif touch_event == 'next_player':
+                        # the directory is listed once, then kept up to date by the CLI events
+                        names = sorted(await lms_player.get_players())
+                        if names:
+                            position = names.index(lms_player.player_name) + 1 if lms_player.player_name in names else 0
+                            name = names[position % len(names)]
+                            if name != lms_player.player_name:
+                                logging.debug(f"switching to player {name}...")
+                                lms_player.set_active_player(name)
+                                current_track = None
+                            eink_display.show_menu(lms_player.player_name)
+
                     elif touch_event == 'previous_album':
-                        if spotify_albums_index > 0:
-                            logging.debug("previous album...")
-                            spotify_albums_index -= 1
-                            eink_display.show_album(
-                                spotify_albums[spotify_albums_index].album,
-                                spotify_albums[spotify_albums_index].artist,
-                                spotify_albums[spotify_albums_index].artwork,
-                            )
+                        logging.debug("previous album...")
+                        scheduler.page(-1)
 
                     elif touch_event == 'next_album':
-                        if spotify_albums_index < len(spotify_albums) - 1:
-                            logging.debug("next album...")
-                            spotify_albums_index += 1
-                            eink_display.show_album(
-                                spotify_albums[spotify_albums_index].album,
-                                spotify_albums[spotify_albums_index].artist,
-                                spotify_albums[spotify_albums_index].artwork,
-                            )
+                        logging.debug("next album...")
+                        scheduler.page(+1)
+
+                    elif touch_event == 'jump':
+                        logging.debug("jump to letter...")
+                        eink_display.show_jump(favorites_index.letters(jump_order, jump_kind), jump_order, jump_kind)
+
+                    elif touch_event in ('jump_order', 'jump_kind'):
+                        if touch_event == 'jump_order':
+                            jump_order = ORDERS[(ORDERS.index(jump_order) + 1) % len(ORDERS)]
+                        else:
+                            jump_kind = KINDS[(KINDS.index(jump_kind) + 1) % len(KINDS)]
+                        eink_display.show_jump(favorites_index.letters(jump_order, jump_kind), jump_order, jump_kind)
+
+                    elif touch_event.startswith('letter:'):
+                        view = favorites_index.view(jump_order, jump_kind)
+                        if view:
+                            letter = touch_event.split(':', 1)[1]
+                            logging.debug(f"jump to {letter} by {jump_order}...")
+                            selector_view, sorted_view, library = view, True, None
+                            spotify_albums_index = favorites_index.position(jump_order, jump_kind, letter)
+                            eink_display.show_selector()
+                            show_selected_album()
+
+                    elif touch_event == 'jump_back':
+                        if jump_kind in LIBRARY_KINDS:
+                            if jump_kind not in libraries:
+                                libraries[jump_kind] = Library(lms_player, jump_kind, config.LIBRARY_DIR)
+                            # the scan time and the first page come in background, a placeholder shows meanwhile
+                            libraries[jump_kind].open_soon()
+                            if library is not libraries[jump_kind]:
+                                library = selector_view = libraries[jump_kind]
+                                spotify_albums_index, library_shown = 0, library.version
+                        elif library is not None:
+                            library, selector_view, sorted_view = None, spotify_albums, False
+                            spotify_albums_index = 0
+                        if selector_view or library is not None:
+                            eink_display.show_selector()
+                            show_selected_album()
 
                     elif touch_event == 'return_menu':
-                        if spotify_albums_index < len(spotify_albums) - 1:
+                        if spotify_albums_index < len(selector_view) - 1:
                             logging.debug("return menu...")
-                            eink_display.show_menu()
+                            scheduler.cancel()
+                            lms_player.cancel_track_update()
+                            eink_display.show_menu(lms_player.player_name)
                             await lms_player.pause()
 
                     elif touch_event == 'next_track':
                         logging.debug("next track touched...")
-                        await lms_player.next()
-                        await lms_player.update_current_track()
-                        current_track = lms_player.current_track
-                        eink_display.update_current_track(
-                            lms_player.current_track.title,
-                            lms_player.current_track.album,
-                            lms_player.current_track.artist,
-                            lms_player.current_track.artwork)
+                        scheduler.skip(+1)
 
                     elif touch_event == 'previous_track':
-                        logging.debug("next track touched...")
-                        await lms_player.previous()
-                        await lms_player.update_current_track()
-                        current_track = lms_player.current_track
-                        eink_display.update_current_track(
-                            lms_player.current_track.title,
-                            lms_player.current_track.album,
-                            lms_player.current_track.artist,
-                            lms_player.current_track.artwork)
+                        logging.debug("previous track touched...")
+                        scheduler.skip(-1)
+
+                    elif touch_event in ('queue', 'queue_up', 'queue_down'):
+                        logging.debug(f"{touch_event}...")
+                        if touch_event == 'queue':
+                            queue_offset = -1  # the previous track stays visible above the playing one
+                        else:
+                            rows = eink_display.QUEUE_ROWS
+                            queue_offset += rows if touch_event == 'queue_down' else -rows
+                        if queue_task is not None:
+                            queue_task.cancel()
+                        queue_task = asyncio.create_task(lms_player.queue.window(queue_offset, eink_display.QUEUE_ROWS))
+
+                    elif touch_event == 'queue_back':
+                        if queue_task is not None:
+                            queue_task.cancel()
+                            queue_task = None
+                        eink_display.show_player()
+                        # draw the track and the play/pause icon again
+                        current_track = None
+                        is_playing = lms_player.player_status != "play"
+
+                    elif touch_event.startswith('volume:'):
+                        volume = int(touch_event.split(':', 1)[1])
+                        if volume != eink_display.volume:
+                            eink_display.show_volume(volume)
+                            scheduler.set_volume(volume)
 
                     elif touch_event == 'play_pause':
 
@@ -138,6 +401,54 @@ async def main():
                             eink_display.show_play_pause(True)
                             is_playing = True
 
+                elif eink_display.screen == 1 and (selector_view or library is not None):
+                    page_offset = scheduler.settled_page()
+                    if library is not None and library_shown != library.version:
+                        # a library page was loaded, the shown card may no longer be a placeholder
+                        library_shown = library.version
+                        spotify_albums_index = min(spotify_albums_index, max(len(library) - 1, 0))
+                        show_selected_album()
+                    elif not selector_view:
+                        pass
+                    elif page_offset:
+                        index = min(max(spotify_albums_index + page_offset, 0), len(selector_view) - 1)
+                        prefetcher.direction = 1 if page_offset > 0 else -1
+                        if index != spotify_albums_index:
+                            spotify_albums_index = index
+                            show_selected_album()
+                    else:
+                        # idle on the selector: prepare the neighbour album cards
+                        prefetcher.step(selector_view, spotify_albums_index)
+
+                elif eink_display.is_on_player_screen() and eink_display.marquee is not None:
+                    eink_display.marquee.step()
+
+                idle_monitor.frame_shown(eink_display.last_frame_at)
+                if idle_monitor.expired and not scheduler.pending and queue_task is None:
+                    # the panel is already in deep sleep, stop polling until a touch or a new song
+                    logging.debug("idle...")
+                    if eink_display.is_on_player_screen() and eink_display.marquee is not None:
+                        eink_display.marquee.rest()
+                    # a due full refresh runs now rather than in front of the waking touch
+                    eink_display.refresh_if_needed()
+                    eink_display.set_polling(False)
+                    lms_player.track_changed.clear()
+                    await lms_player.set_idle(True)
+                    # the periodic full refresh coming due meanwhile runs on time, and the progress bar
+                    # moves pixel by pixel, writing its region only and without counting as activity
+                    while not await idle_monitor.sleep_until(eink_display.touched, lms_player.track_changed,
+                                                             timeout=idle_timeout()):
+                        eink_display.refresh_if_needed()
+                        progress = track_progress()
+                        if progress is not None and eink_display.is_on_player_screen():
+                            eink_display.show_progress(progress)
+                    logging.debug("wake up...")
+                    # the progress bar catches up at once
+                    progress_version = None
+                    eink_display.set_polling(True)
+                    await lms_player.set_idle(False)
+                    continue
+
                 await asyncio.sleep(0.05)
 
             except Exception as e:
@@ -153,5 +464,15 @@ async def main():
     finally:
         logging.debug("cleaning...")
         if eink_display:
-            eink_display.cleanup()
+            await eink_display.cleanup()
             await eink_display.stop()
+        if lms_player:
+            await lms_player.close()
+        if memory_report_task:
+            memory_report_task.cancel()
+        if lag_task:
+            lag_task.cancel()
+        if metrics_server:
+            await metrics_server.stop()
+        if trace:
+            trace.close()
@@ -0,0 +1,65 @@
+import logging
+
+from .cache import LRUCache
+
+# playlist events leaving the tracks of the playlist unchanged
+_UNCHANGED = {'newsong', 'pause', 'stop', 'jump', 'index', 'open'}
+
+
+class PlayQueue:
+    """Tracks of the current playlist around the playing one, fetched one page at a time.
+
+    Pages come from paged status queries and are kept until a playlist event
+    changes the playlist, so large playlists are never downloaded whole.
+    `version` changes whenever the shown window may be outdated.
+    """
+
+    PAGE_SIZE = 10
+
+    def __init__(self, player, pages=4):
+        self.player = player
+        self.pages = LRUCache(pages)  # (index, title, artist) lists by page number
+        self.current = None  # index of the playing track
+        self.length = None
+        self.version = 0
+
+    def invalidate(self):
+        """drop the cached pages, e.g. after tracks were added or the active player changed."""
+        self.pages.clear()
+        self.current = self.length = None
+        self.version += 1
+
+    def track_changed(self, index):
+        self.current = index
+        self.version += 1
+
+    def handle_event(self, parts):
+        """update from the parts of a playlist event of the active player."""
+        if parts[2:3] == ['newsong']:
+            if parts[-1].isdigit():
+                self.track_changed(int(parts[-1]))
+            else:
+                self.invalidate()
+        elif parts[2:3] and parts[2] not in _UNCHANGED:
+            logging.debug(f"playlist {parts[2]}: queue invalidated")
+            self.invalidate()
+
+    async def _page(self, number):
+        tracks = self.pages.get(number)
+        if tracks is None:
+            tracks, self.current, self.length = await self.player.get_playlist_page(
+                number * self.PAGE_SIZE, self.PAGE_SIZE
+            )
+            self.pages.put(number, tracks)
+        return tracks
+
+    async def window(self, offset, count):
+        """count tracks starting offset tracks from the playing one, kept inside the playlist."""
+        if self.current is None or self.length is None:
+            _, self.current, self.length = await self.player.get_playlist_page(0, 0)
+        start = max(min(self.current + offset, self.length - count), 0)
+        end = min(start + count, self.length)
+        tracks = []
+        for number in range(start // self.PAGE_SIZE, (end - 1) // self.PAGE_SIZE + 1):
+            tracks.extend(await self._page(number))
+        return [track for track in tracks if start <= track[0] < end]
@@ -0,0 +1,57 @@
+import logging
+
+from .cache import LRUCache
+
+
+class AlbumPrefetcher:
+    """Render album cards around the selector position while the panel is idle."""
+
+    def __init__(self, display, depth):
+        self.display = display
+        self.depth = depth
+        self.direction = 1  # last browsing direction, +1 next or -1 previous
+        # both sides of the window stay cached, plus the shown album
+        self.frames = LRUCache(2 * depth + 1)
+        self.rendered_window = None
+
+    @staticmethod
+    def _key(album):
+        return album.url, album.album, album.artist, album.artwork
+
+    def get(self, album):
+        """return the pre-rendered frame of album, or None."""
+        return self.frames.get(self._key(album))
+
+    def _targets(self, albums, index):
+        # the browsing direction first, then the opposite one
+        for direction in (self.direction, -self.direction):
+            for offset in range(1, self.depth + 1):
+                target = index + direction * offset
+                if 0 <= target < len(albums):
+                    yield albums[target]
+
+    def step(self, albums, index):
+        """render the most likely next album card not rendered yet.
+
+        Returns False once the whole window is rendered.
+        """
+        # another view, or library pages loaded in place of placeholders, make a new window
+        window = (id(albums), getattr(albums, 'version', None), index, self.direction, len(albums))
+        if window == self.rendered_window:
+            return False
+
+        # touching the cached frames first keeps the window from evicting itself
+        cached, missing = [], []
+        for album in self._targets(albums, index):
+            (missing if self.frames.get(self._key(album)) is None else cached).append(album)
+        if not missing:
+            self.rendered_window = window
+            return False
+        album = missing[0]
+        logging.debug(f"pre-rendering {album.album}")
+        self.frames.put(self._key(album), self.display.render_album(album.album, album.artist, album.artwork))
+        if any(self._key(album) not in self.frames for album in cached + [album]):
+            # the memory budget holds less than the window: stop before it evicts itself
+            self.rendered_window = window
+            return False
+        return True
@@ -0,0 +1,115 @@
+import logging
+import time
+
+from lib.epd2in13_V4 import EPD_WIDTH
+
+ROW_BYTES = (EPD_WIDTH + 7) // 8  # packed panel rows, padded to whole bytes
+
+
+def changed_pixels(previous, buffer):
+    """number of pixels differing between two packed panel buffers."""
+    if previous is None or len(previous) != len(buffer):
+        return len(buffer) * 8
+    return (int.from_bytes(previous, 'big') ^ int.from_bytes(buffer, 'big')).bit_count()
+
+
+def panel_window(box):
+    """(first byte, last byte + 1, first row, last row + 1) of the packed panel buffer covering a canvas box.
+
+    The canvas is the panel turned a quarter: panel x is EPD_WIDTH - 1 - canvas y
+    and panel rows are canvas columns. Windows are widened to whole bytes.
+    """
+    x0, y0, x1, y1 = box
+    return (EPD_WIDTH - y1) // 8, (EPD_WIDTH - 1 - y0) // 8 + 1, x0, x1
+
+
+def window_union(window, other):
+    return min(window[0], other[0]), max(window[1], other[1]), min(window[2], other[2]), max(window[3], other[3])
+
+
+def window_data(buffer, window):
+    """bytes of the window, row after row, as written to the panel RAM."""
+    first, last, top, bottom = window
+    return b''.join(buffer[row * ROW_BYTES + first:row * ROW_BYTES + last] for row in range(top, bottom))
+
+
+def patch_window(previous, buffer, window):
+    """previous with the window copied from buffer."""
+    first, last, top, bottom = window
+    patched = bytearray(previous)
+    for row in range(top, bottom):
+        patched[row * ROW_BYTES + first:row * ROW_BYTES + last] = buffer[row * ROW_BYTES + first:row * ROW_BYTES + last]
+    return bytes(patched)
+
+
+class RefreshPolicy:
+    """Decide when the expensive full refresh clearing ghosting is worth it.
+
+    Ghosting is estimated from the number of partial updates and the area
+    they changed since the last full refresh. Once either budget is spent,
+    or the periodic interval is over, a full refresh is due, but it only
+    runs after the user has been idle for `idle_delay` seconds.
+    """
+
+    def __init__(self, partial_budget, area_budget, interval, idle_delay):
+        self.partial_budget = partial_budget
+        self.area_budget = area_budget  # changed pixels
+        self.interval = interval  # seconds
+        self.idle_delay = idle_delay
+
+        self.partial_count = 0
+        self.changed_area = 0
+        self.last_full = time.monotonic()
+        self.last_interaction = 0
+        self.deferring = False
+
+        self.metrics = {
+            'full_refreshes': 0,
+            'partial_refreshes': 0,
+            'region_refreshes': 0,
+            'skipped_refreshes': 0,
+            'deferred_full_refreshes': 0,
+            'changed_pixels': 0,
+        }
+
+    def interaction(self):
+        """note a user interaction, full refreshes wait for the burst to end."""
+        self.last_interaction = time.monotonic()
+
+    def record_partial(self, area, region=False):
+        self.partial_count += 1
+        self.changed_area += area
+        self.metrics['region_refreshes' if region else 'partial_refreshes'] += 1
+        self.metrics['changed_pixels'] += area
+
+    def record_skipped(self):
+        self.metrics['skipped_refreshes'] += 1
+
+    def record_full(self):
+        self.partial_count = 0
+        self.changed_area = 0
+        self.last_full = time.monotonic()
+        self.deferring = False
+        self.metrics['full_refreshes'] += 1
+
+    @property
+    def ghosting(self):
+        """spent fraction of the ghosting budget, 1 or more means a full refresh is due."""
+        return max(self.partial_count / self.partial_budget, self.changed_area / self.area_budget)
+
+    def full_refresh_in(self):
+        """seconds until the periodic full refresh is due."""
+        return max(self.last_full + self.interval - time.monotonic(), 0)
+
+    def should_full_refresh(self):
+        now = time.monotonic()
+        if self.ghosting < 1 and now - self.last_full < self.interval:
+            return False
+        if now - self.last_interaction < self.idle_delay:
+            if not self.deferring:
+                logging.debug(f"full refresh deferred, ghosting at {self.ghosting:.0%}")
+                self.metrics['deferred_full_refreshes'] += 1
+                self.deferring = True
+            return False
+        logging.debug(f"full refresh after {self.partial_count} partial updates, ghosting at {self.ghosting:.0%}")
+        return True
@@ -0,0 +1,175 @@
+"""Calibrate the SPI link to the panel: ``python -m micro_player.spi calibrate``.
+
+Frames are written to the panel RAM, without refreshing it, at each clock
+speed and transfer size. The fastest setting whose frames read back intact
+is saved to SPI_SETTINGS_FILE and applied when the player starts. Without
+read back, the defaults are kept unless unverified settings are accepted.
+Stop the player before calibrating, both use the same pins.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import time
+
+from . import config
+
+SPEEDS = (2000000, 4000000, 8000000, 10000000, 16000000, 20000000)
+FAST_SPEEDS = (25000000, 32000000)
+CHUNKS = (512, 1024, 2048, 4096)
+# the SSD1680 write cycle is 50 ns: faster clocks are kept only when read back intact
+SAFE_SPEED = 20000000
+
+
+def load_spi_settings(path=None):
+    """apply the calibrated settings to epdconfig, before the panel is initialised."""
+    path = path or config.SPI_SETTINGS_FILE
+    try:
+        with open(path) as f:
+            settings = json.load(f)
+        speed, chunk = int(settings['speed_hz']), int(settings['chunk'])
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        logging.warning(f"ignoring SPI settings {path}: {e}")
+        return None
+    from lib import epdconfig
+    epdconfig.SPI_SPEED_HZ = speed
+    epdconfig.SPI_CHUNK = chunk
+    logging.debug(f"SPI at {speed / 1e6:g} MHz, {chunk} bytes per transfer")
+    return settings
+
+
+def _frame(size, seed):
+    return random.Random(seed).randbytes(size)
+
+
+def _write_frame(epd, data):
+    epd.SetCursor(0, 0)
+    epd.send_command(0x24)
+    epd.send_data2(data)
+
+
+def _read_frame(epd, size):
+    """read the black and white RAM back, one transfer at a time."""
+    from lib import epdconfig
+    row_bytes = (epd.width + 7) // 8
+    data = bytearray()
+    while len(data) < size:
+        count = min(epdconfig.SPI_CHUNK, size - len(data))
+        epd.SetCursor(0, len(data) // row_bytes)
+        epd.send_command(0x27)  # read RAM, the first byte is a dummy
+        epdconfig.digital_write(epd.dc_pin, 1)
+        data += bytes(epdconfig.spi_readbytes(count + 1)[1:])
+    return bytes(data)
+
+
+def _measure(epd, speed, chunk, frames, readback):
+    """(bytes per second, frames intact or None when unverified)."""
+    from lib import epdconfig
+    epdconfig.spi.max_speed_hz = speed
+    epdconfig.SPI_CHUNK = chunk
+    size = ((epd.width + 7) // 8) * epd.height
+    data = _frame(size, speed ^ chunk)
+    begin = time.perf_counter()
+    for _ in range(frames):
+        _write_frame(epd, data)
+    rate = size * frames / (time.perf_counter() - begin)
+    if not readback:
+        return rate, None
+    for seed in range(3):
+        data = _frame(size, seed)
+        _write_frame(epd, data)
+        if _read_frame(epd, size) != data:
+            return rate, False
+    return rate, True
+
+
+def calibrate(frames=20, max_speed=False, path=None, accept_unverified=False):
+    """measure each speed and transfer size, save and return the best one."""
+    from lib import epdconfig
+    from lib.epd2in13_V4 import EPD
+
+    epd = EPD()
+    epd.init(epd.FULL_UPDATE)
+    try:
+        # the read RAM command needs MISO, which most HATs leave unconnected
+        epdconfig.spi.max_speed_hz = SPEEDS[0]
+        size = ((epd.width + 7) // 8) * epd.height
+        probe = _frame(size, 0)
+        _write_frame(epd, probe)
+        readback = _read_frame(epd, size) == probe
+        if not readback:
+            print("no read back from the panel, frames are unverified")
+
+        results = []
+        speeds = SPEEDS + (FAST_SPEEDS if max_speed and readback else ())
+        for speed in speeds:
+            for chunk in CHUNKS:
+                try:
+                    rate, intact = _measure(epd, speed, chunk, frames, readback)
+                except OSError as e:
+                    logging.warning(f"{speed / 1e6:g} MHz, {chunk} bytes: {e}")
+                    continue
+                results.append((speed, chunk, rate, intact))
+                status = {True: "ok", False: "CORRUPT", None: "unverified"}[intact]
+                print(f"{speed / 1e6:5g} MHz {chunk:5} B  {rate / 1000:7.1f} kB/s "
+                      f"of {speed / 8000:7.1f} kB/s ({rate * 8 / speed:4.0%})  {status}")
+    finally:
+        epdconfig.module_exit()
+
+    stable = [result for result in results
+              if result[3] or (result[3] is None and accept_unverified and result[0] <= SAFE_SPEED)]
+    if not stable:
+        if not readback and not accept_unverified:
+            print("nothing could be verified, keeping the defaults (--accept-unverified saves the fastest setting)")
+        else:
+            print("no stable setting found, keeping the defaults")
+        return None
+    # within measurement noise of the best, the slowest clock is the safest
+    best = max(result[2] for result in stable)
+    speed, chunk, rate, intact = min(
+        (result for result in stable if result[2] >= best * 0.98), key=lambda result: (result[0], -result[2]))
+    settings = {
+        'speed_hz': speed,
+        'chunk': chunk,
+        'bytes_per_second': round(rate),
+        'theoretical_bytes_per_second': speed // 8,
+        'verified': bool(intact),
+    }
+    path = path or config.SPI_SETTINGS_FILE
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(settings, f, indent=2)
+    print(f"saved {speed / 1e6:g} MHz, {chunk} bytes per transfer ({rate / 1000:.1f} kB/s) to {path}")
+    return settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('calibrate', help=calibrate.__doc__)
+    run.add_argument('--frames', type=int, default=20, help="frames written per setting")
+    run.add_argument('--max-speed', action='store_true',
+                     help=f"also try clocks above {SAFE_SPEED / 1e6:g} MHz, when frames can be read back")
+    run.add_argument('--accept-unverified', action='store_true',
+                     help=f"without read back, save the fastest setting up to {SAFE_SPEED / 1e6:g} MHz anyway")
+
+    commands.add_parser('show', help="print the saved settings")
+
+    args = parser.parse_args()
+    logging.basicConfig(level=config.LOG_LEVEL)
+    if args.command == 'calibrate':
+        calibrate(args.frames, args.max_speed, accept_unverified=args.accept_unverified)
+    else:
+        try:
+            with open(config.SPI_SETTINGS_FILE) as f:
+                print(f.read())
+        except OSError:
+            print(f"no settings in {config.SPI_SETTINGS_FILE}, using the defaults")
+
+
+if __name__ == '__main__':
+    main()
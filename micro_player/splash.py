@@ -0,0 +1,45 @@
+import logging
+import os
+
+from lib import epd2in13_V4  # eInk display stuff
+from . import config, get_asset_path
+
+# packed 1-bit panel buffer: 16 bytes per row, 250 rows
+BUFFER_SIZE = ((epd2in13_V4.EPD_WIDTH + 7) // 8) * epd2in13_V4.EPD_HEIGHT
+
+
+def _read_buffer(path):
+    try:
+        with open(path, 'rb') as f:
+            buffer = f.read()
+    except OSError:
+        return None
+    if len(buffer) != BUFFER_SIZE:
+        logging.warning(f"ignoring screen buffer {path}: wrong size {len(buffer)}")
+        return None
+    return buffer
+
+
+async def show_splash(epd):
+    """draw the last screen, or the pre-packed splash, without loading PIL.
+
+    The waveform keeps running while the rest of the application loads.
+    Returns the buffer shown, or None.
+    """
+    buffer = _read_buffer(config.LAST_SCREEN_FILE) or _read_buffer(get_asset_path('splash.bin'))
+    await epd.init(epd.FULL_UPDATE)
+    if buffer is not None:
+        await epd.displayPartBaseImage(buffer, wait=False)
+    return buffer
+
+
+def save_last_screen(buffer):
+    """persist the packed panel buffer shown on the next start."""
+    try:
+        os.makedirs(os.path.dirname(config.LAST_SCREEN_FILE), exist_ok=True)
+        tmp = config.LAST_SCREEN_FILE + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(bytes(buffer))
+        os.replace(tmp, config.LAST_SCREEN_FILE)
+    except OSError as e:
+        logging.warning(f"unable to save last screen: {e}")
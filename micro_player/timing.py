@@ -0,0 +1,26 @@
+import logging
+import time
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """Collect the duration of each startup phase."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.phases = []
+
+    @contextmanager
+    def phase(self, name):
+        """time the wrapped block as a named phase."""
+        begin = time.monotonic()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.monotonic() - begin))
+
+    def report(self):
+        """log the per-phase startup breakdown."""
+        total = time.monotonic() - self.start
+        details = ", ".join(f"{name} {duration:.2f}s" for name, duration in self.phases)
+        logging.info(f"startup in {total:.2f}s ({details})")
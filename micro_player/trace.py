@@ -0,0 +1,427 @@
+"""Record and replay touch and LMS event traces: ``python -m micro_player.trace replay <file>``.
+
+Set TRACE_FILE to record a session. A replay runs the application against a
+simulated panel and touch controller, fed from the trace, and reports how long
+each input took to reach the panel.
+
+Only the touches, the CLI events and the controlled player are recorded. A
+replay never contacts the server: queries get synthetic answers built from the
+trace and playback commands are only counted, so a trace always replays the
+same way and never drives a real player.
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import os
+import statistics
+import struct
+import sys
+import tempfile
+import time
+import urllib.parse
+
+from . import config
+from .lms import Player, Track
+
+MAGIC = b'MPT1'
+RECORD = struct.Struct('<IBH')  # milliseconds since the start, kind, payload length
+TOUCH = struct.Struct('<HHH')  # x, y, size as reported by the GT1151
+TOUCH_EVENT, LMS_EVENT, PLAYER_EVENT = 0, 1, 2
+
+
+class TraceWriter:
+    """Append timestamped touch reports and raw CLI lines to a trace file."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.file = open(path, 'wb')
+        self.file.write(MAGIC)
+        self.start = time.monotonic()
+
+    def _write(self, kind, payload):
+        if self.file.closed:
+            return
+        elapsed = int((time.monotonic() - self.start) * 1000)
+        self.file.write(RECORD.pack(elapsed, kind, len(payload)))
+        self.file.write(payload)
+
+    def touch(self, x, y, size):
+        self._write(TOUCH_EVENT, TOUCH.pack(x, y, size))
+
+    def event(self, line):
+        """record a CLI line as received, still url-quoted."""
+        self._write(LMS_EVENT, line.rstrip(b'\n'))
+
+    def player(self, player_id, name):
+        """record the id of the controlled player."""
+        self._write(PLAYER_EVENT, f"{player_id} {name}".encode())
+
+    def close(self):
+        self.file.close()
+
+
+def read_trace(path):
+    """list of (seconds, kind, data).
+
+    data is (x, y, size) for touches, the quoted line for events and
+    (player id, name) for the controlled player.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a trace file")
+    records = []
+    offset = len(MAGIC)
+    while offset + RECORD.size <= len(data):
+        elapsed, kind, length = RECORD.unpack_from(data, offset)
+        offset += RECORD.size
+        payload = data[offset:offset + length]
+        offset += length
+        if kind == TOUCH_EVENT:
+            payload = TOUCH.unpack(payload)
+        elif kind == PLAYER_EVENT:
+            payload = tuple(payload.decode().split(' ', 1))
+        records.append((elapsed / 1000, kind, payload))
+    return records
+
+
+class _Pin:
+    """gpiozero style input whose edges are driven by the simulation."""
+
+    def __init__(self):
+        self.when_activated = None
+        self.when_deactivated = None
+
+
+class SimulatedBoard:
+    """Stand-in for lib.epdconfig: a panel with BUSY timings and a GT1151 fed by the replay.
+
+    Durations are those measured on the 2.13" V4 panel, divided by speed.
+    Like the SSD1680, the panel keeps BUSY high in deep sleep until a reset.
+    """
+    EPD_RST_PIN = 17
+    EPD_DC_PIN = 25
+    EPD_CS_PIN = 8
+    EPD_BUSY_PIN = 24
+    TRST = 22
+    INT = 27
+
+    FULL_REFRESH = 2.0
+    PARTIAL_REFRESH = 0.3
+    RESET = 0.002
+    SWRESET = 0.01
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.address = 0x0
+        self.GPIO_BUSY_PIN = _Pin()
+        self.GPIO_INT = _Pin()
+        self.busy = 0
+        self.release = None
+        self.dc = 0
+        self.rst = 1
+        self.command = None
+        self.update_mode = None
+        self.sleeping = False
+        self.point = None  # touch waiting to be read by GT_Scan
+        self.frames = []  # (monotonic time, full) of each refresh started
+
+    def _hold_busy(self, duration):
+        loop = asyncio.get_running_loop()
+        if self.release is not None:
+            self.release.cancel()
+        if not self.busy:
+            self.busy = 1
+            if self.GPIO_BUSY_PIN.when_activated:
+                self.GPIO_BUSY_PIN.when_activated()
+        self.release = loop.call_later(duration / self.speed, self._release_busy)
+
+    def _sleep(self):
+        if self.release is not None:
+            self.release.cancel()
+            self.release = None
+        self.sleeping = True
+        if not self.busy:
+            self.busy = 1
+            if self.GPIO_BUSY_PIN.when_activated:
+                self.GPIO_BUSY_PIN.when_activated()
+
+    def _release_busy(self):
+        self.release = None
+        self.busy = 0
+        if self.GPIO_BUSY_PIN.when_deactivated:
+            self.GPIO_BUSY_PIN.when_deactivated()
+
+    def digital_write(self, pin, value):
+        if pin == self.EPD_DC_PIN:
+            self.dc = value
+        elif pin == self.EPD_RST_PIN:
+            if value and not self.rst:
+                self.sleeping = False
+                self._hold_busy(self.RESET)
+            self.rst = value
+
+    def digital_read(self, pin):
+        if pin == self.EPD_BUSY_PIN:
+            return self.busy
+        elif pin == self.INT:
+            return 0 if self.point is not None else 1
+
+    def delay_ms(self, delaytime):
+        time.sleep(delaytime / 1000.0 / self.speed)
+
+    def spi_writebyte(self, data):
+        if not self.dc:
+            self.command = data[0]
+            if self.command == 0x12:
+                self._hold_busy(self.SWRESET)
+            elif self.command == 0x20:
+                full = self.update_mode != 0xFF
+                self.frames.append((time.monotonic(), full))
+                self._hold_busy(self.FULL_REFRESH if full else self.PARTIAL_REFRESH)
+        elif self.command == 0x22:
+            self.update_mode = data[0]
+        elif self.command == 0x10 and data[0] & 0x03:
+            self._sleep()
+
+    spi_writebyte2 = spi_writebyte
+
+    def press(self, x, y, size):
+        self.point = (x, y, size)
+        if self.GPIO_INT.when_deactivated:
+            self.GPIO_INT.when_deactivated()
+
+    def i2c_writebyte(self, reg, value):
+        if reg == 0x814E:
+            self.point = None
+
+    def i2c_readbyte(self, reg, len):
+        if reg == 0x8140:
+            return list(b'1151')[:len]
+        if reg == 0x814E:
+            return [0x81 if self.point is not None else 0x00]
+        if reg == 0x814F and self.point is not None:
+            x, y, size = self.point
+            return list(struct.pack('<BHHHB', 0, x, y, size, 0))[:len]
+        return [0] * len
+
+    def module_init(self):
+        return 0
+
+    def module_exit(self):
+        pass
+
+
+def install_board(board):
+    """route the panel and touch drivers to board. Must run before lib drivers are imported."""
+    import lib
+    lib.epdconfig = board
+    sys.modules['lib.epdconfig'] = board
+
+
+class Replay:
+    """Feed a trace to the application and time each input until the next refresh."""
+
+    def __init__(self, records, board, speed=1.0, settle=3.0):
+        self.records = records
+        self.board = board
+        self.speed = speed
+        self.settle = settle
+        self.inputs = []  # (monotonic time, label)
+        self.player = None
+        self.done = asyncio.Event()
+
+    def players(self, name):
+        """player name -> id recorded in the trace.
+
+        Traces recorded before the players were, stand name for the player
+        of the first event.
+        """
+        directory = {}
+        for _, kind, data in self.records:
+            if kind == PLAYER_EVENT:
+                directory.setdefault(data[1], data[0])
+        if name not in directory:
+            events = [data for _, kind, data in self.records if kind == LMS_EVENT and data]
+            if events:
+                directory[name] = urllib.parse.unquote(events[0].split()[0].decode())
+        return directory
+
+    async def run(self, player):
+        self.player = player
+        start = time.monotonic()
+        for elapsed, kind, data in self.records:
+            if kind == PLAYER_EVENT:
+                # switches come again from the replayed touches
+                continue
+            delay = start + elapsed / self.speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if kind == TOUCH_EVENT:
+                self.inputs.append((time.monotonic(), 'touch'))
+                self.board.press(*data)
+            else:
+                event = urllib.parse.unquote(data.decode())
+                parts = event.split()
+                self.inputs.append((time.monotonic(), ' '.join(parts[1:3]) or 'event'))
+                await player.handle_event(event)
+        await asyncio.sleep(self.settle)
+        self.done.set()
+
+    def latencies(self):
+        """seconds from each input to the next refresh, grouped by input label."""
+        results = {}
+        starts = [started for started, _ in self.board.frames]
+        for injected, label in self.inputs:
+            latency = next((started - injected for started in starts if started >= injected), None)
+            results.setdefault(label, []).append(latency)
+        return results
+
+    def report(self):
+        full = sum(1 for _, is_full in self.board.frames if is_full)
+        print(f"{len(self.inputs)} inputs replayed at x{self.speed:g}, "
+              f"{len(self.board.frames)} refreshes ({full} full), "
+              f"{len(self.player.commands) if self.player else 0} playback commands not sent")
+        for label, values in sorted(self.latencies().items()):
+            answered = sorted(value for value in values if value is not None)
+            if not answered:
+                print(f"  {label:<20} {len(values):4} inputs, no refresh")
+                continue
+            p95 = answered[min(len(answered) - 1, int(len(answered) * 0.95))]
+            print(f"  {label:<20} {len(values):4} inputs, {len(values) - len(answered)} without refresh, "
+                  f"median {statistics.median(answered) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, "
+                  f"max {answered[-1] * 1000:.0f} ms")
+
+
+class ReplayPlayer(Player):
+    """Player taking its CLI events from a replay, never contacting the server.
+
+    The players come from the trace, the current track is the title of the
+    last new song event, without cover, and favorites, library and play queue
+    are empty. Playback commands are counted but not sent.
+    """
+
+    def __init__(self, replay, *args, **kwargs):
+        self.replay = replay
+        self.commands = []  # (monotonic time, command) not sent
+        self.titles = {}  # player id -> title of its last new song
+        super().__init__(*args, **kwargs)
+        self.directory = replay.players(self.player_name)
+        self.directory_loaded = True
+
+    def _get_session(self):
+        raise RuntimeError("a replay never contacts the server")
+
+    async def _get_player(self, name=None):
+        raise RuntimeError("a replay never contacts the server")
+
+    async def _load_directory(self):
+        self.directory_loaded = True
+
+    async def _handle_client_event(self, player_id, parts):
+        if 'new' in parts or 'reconnect' in parts:
+            if player_id not in self.directory.values():
+                self.directory[player_id] = player_id
+        else:
+            await super()._handle_client_event(player_id, parts)
+
+    def _command(self, *command):
+        logging.debug(f"not sent: {' '.join(command)}")
+        self.commands.append((time.monotonic(), ' '.join(command)))
+
+    async def _get_image(self, url):
+        return None
+
+    async def get_spotify_favorite(self, with_artwork=True):
+        return []
+
+    async def get_library_stamp(self):
+        raise ConnectionError("the library is not recorded in traces")
+
+    async def get_library_page(self, kind, start, count):
+        raise ConnectionError("the library is not recorded in traces")
+
+    async def get_playlist_page(self, start, count):
+        return [], 0, 0
+
+    async def play_url(self, url):
+        self._command("load", url)
+
+    async def play(self):
+        self._command("play")
+
+    async def pause(self):
+        self._command("pause")
+
+    async def skip(self, offset):
+        if offset:
+            self._command("playlist", "index", f"{offset:+d}")
+
+    async def set_volume(self, volume):
+        self._command("mixer", "volume", str(volume))
+        self.volume = volume
+
+    async def update_current_track(self):
+        self.current_track = Track(title=self.titles.get(self.player_id, ""))
+        self.position_version += 1
+
+    async def handle_event(self, event_response):
+        parts = event_response.split()
+        if len(parts) > 3 and parts[1] == 'playlist' and parts[2] == 'newsong':
+            # playlist newsong <title> <index>
+            self.titles[parts[0]] = " ".join(parts[3:-1] if parts[-1].isdigit() else parts[3:])
+        await super().handle_event(event_response)
+
+    async def subscribe_to_player_events(self):
+        await self.replay.run(self)
+
+
+async def replay_trace(path, speed=1.0, settle=3.0):
+    """run the application on a simulated board fed by the trace at path."""
+    board = SimulatedBoard(speed)
+    install_board(board)
+    replay = Replay(read_trace(path), board, speed, settle)
+    # keep the real last screen and do not record the replay itself
+    config.LAST_SCREEN_FILE = os.path.join(tempfile.mkdtemp(prefix='micro_player'), 'last_screen.bin')
+    config.TRACE_FILE = ""
+
+    logging.info(f"replaying {path}, without contacting {config.LMS_SERVER}")
+    from .micro_player import main
+    app = asyncio.create_task(main(player_factory=functools.partial(ReplayPlayer, replay)))
+    finished = asyncio.create_task(replay.done.wait())
+    await asyncio.wait([app, finished], return_when=asyncio.FIRST_COMPLETED)
+    app.cancel()
+    finished.cancel()
+    await asyncio.gather(app, finished, return_exceptions=True)
+    replay.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    replay = commands.add_parser('replay', help=replay_trace.__doc__)
+    replay.add_argument('trace')
+    replay.add_argument('--speed', type=float, default=1.0, help="replay speed factor, panel timings included")
+    replay.add_argument('--settle', type=float, default=3.0, help="seconds to wait after the last input")
+
+    show = commands.add_parser('show', help="print the records of a trace")
+    show.add_argument('trace')
+
+    args = parser.parse_args()
+    logging.basicConfig(level=config.LOG_LEVEL)
+    if args.command == 'replay':
+        asyncio.run(replay_trace(args.trace, args.speed, args.settle))
+    else:
+        for elapsed, kind, data in read_trace(args.trace):
+            if kind == TOUCH_EVENT:
+                print(f"{elapsed:9.3f} touch  {data}")
+            elif kind == PLAYER_EVENT:
+                print(f"{elapsed:9.3f} player {data[1]} ({data[0]})")
+            else:
+                print(f"{elapsed:9.3f} event  {urllib.parse.unquote(data.decode())}")
+
+
+if __name__ == '__main__':
+    main()